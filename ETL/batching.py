@@ -0,0 +1,66 @@
+from ETL.metrics import currentRssBytes
+import logging
+import os
+import threading
+
+BATCH_SIZE = int(os.getenv("BATCH_SIZE") or 5000)
+BATCH_MIN = int(os.getenv("BATCH_MIN") or 500)
+BATCH_MAX = int(os.getenv("BATCH_MAX") or 100_000)
+ADAPTIVE_BATCH = (os.getenv("ADAPTIVE_BATCH") or "1") != "0"
+# aim for warehouse writes of about this long per batch
+BATCH_TARGET_SECONDS = float(os.getenv("BATCH_TARGET_SECONDS") or 2.0)
+# keep each COPY payload under this many bytes
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES") or 64 * 1024 * 1024)
+# halve the batch while the process is above this RSS; 0 disables the check
+BATCH_MEMORY_LIMIT = int(os.getenv("BATCH_MEMORY_LIMIT_MB") or 0) * 1024 * 1024
+
+
+class BatchSizer:
+    def __init__(self, stage, initial=None, minimum=BATCH_MIN, maximum=BATCH_MAX, adaptive=ADAPTIVE_BATCH):
+        initial = initial or int(os.getenv(f"BATCH_SIZE_{stage.upper()}") or BATCH_SIZE)
+        self.stage = stage
+        self.minimum = min(minimum, initial)
+        self.maximum = max(maximum, initial)
+        self.adaptive = adaptive
+        self.initial = initial
+        self.size = initial
+        self.sizes = [initial]
+        self._lock = threading.Lock()
+
+    def current(self):
+        return self.size
+
+    def observe(self, keys, write_seconds, bytes_sent):
+        # keys is what the batch size counts: the source keys paged over, which
+        # for facts is orders while the rows written are their items
+        if not self.adaptive or keys <= 0:
+            return
+
+        with self._lock:
+            proposed = self.size * 2
+            if write_seconds > 0:
+                proposed = min(proposed, BATCH_TARGET_SECONDS * keys / write_seconds)
+            if bytes_sent > 0:
+                proposed = min(proposed, BATCH_MAX_BYTES * keys / bytes_sent)
+            if BATCH_MEMORY_LIMIT and currentRssBytes() > BATCH_MEMORY_LIMIT:
+                proposed = min(proposed, self.size / 2)
+
+            size = int(max(self.minimum, min(self.maximum, proposed)))
+            if size != self.size:
+                logging.info(f"{self.stage} batch size {self.size} -> {size} "
+                             f"({keys} keys written in {write_seconds:.2f}s).")
+                self.size = size
+                self.sizes.append(size)
+
+    def observeBatch(self, batch_metrics):
+        values = batch_metrics.values
+        self.observe(values["keys_in"] or values["rows_in"], values["write_s"] + values["commit_s"], values["bytes_sent"])
+
+    def summary(self):
+        return {
+            "initial": self.initial,
+            "final": self.size,
+            "min": min(self.sizes),
+            "max": max(self.sizes),
+            "adjustments": len(self.sizes) - 1,
+        }
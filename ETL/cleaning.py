@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import os
+import threading
+
+# distinct raw values remembered per column; past this new values are still
+# cleaned once per batch, just not kept
+CLEAN_MEMO_LIMIT = int(os.getenv("CLEAN_MEMO_LIMIT") or 100_000)
+
+_MISSING = object()
+
+
+class Cleaner:
+    # Normalization rules declared per column. Each rule takes a Series and
+    # returns the cleaned Series; it only ever sees the distinct raw values,
+    # and the results are broadcast back through the factorized codes.
+    def __init__(self, rules, memo_limit=CLEAN_MEMO_LIMIT):
+        self.rules = rules
+        self.memo_limit = memo_limit
+        self._memo = {col: {} for col in rules}
+        self._lock = threading.Lock()
+
+    def cleanColumn(self, col, values: pd.Series) -> pd.Series:
+        codes, uniques = pd.factorize(values)
+        uniques = list(uniques)
+        memo = self._memo[col]
+
+        with self._lock:
+            cleaned = [memo.get(value, _MISSING) for value in uniques]
+        todo = [i for i, value in enumerate(cleaned) if value is _MISSING]
+        if todo:
+            raw = [uniques[i] for i in todo]
+            fresh = self.rules[col](pd.Series(raw, dtype=object)).tolist()
+            with self._lock:
+                room = max(0, self.memo_limit - len(memo))
+                memo.update(zip(raw[:room], fresh[:room]))
+            for i, value in zip(todo, fresh):
+                cleaned[i] = value
+
+        # code -1 (a missing value) picks the trailing None
+        out = np.empty(len(cleaned) + 1, dtype=object)
+        out[:-1] = cleaned
+        out[-1] = None
+        out = pd.Series(out[codes], index=values.index)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return out.astype("category")
+        return out.astype(values.dtype) if values.dtype != object else out
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        for col in self.rules:
+            if col in df.columns:
+                df[col] = self.cleanColumn(col, df[col])
+        return df
+
+    def memoSize(self):
+        with self._lock:
+            return {col: len(memo) for col, memo in self._memo.items()}
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import os
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# opt-in: build source batches column by column in compact dtypes
+COLUMNAR = (os.getenv("COLUMNAR") or "0") == "1"
+
+STRING_DTYPE = "string[pyarrow]" if pa is not None else "string"
+
+
+def _column(values, dtype):
+    if dtype == "int32":
+        try:
+            return np.fromiter(values, dtype=np.int32, count=len(values))
+        except (OverflowError, TypeError, ValueError):
+            # NULLs or ids past 2**31 - keep whatever pandas infers
+            return pd.array(values)
+    if dtype == "category":
+        return pd.Categorical(values)
+    if dtype == "string":
+        if pa is not None:
+            return pd.array(pa.array(values, type=pa.string(), from_pandas=True), dtype=STRING_DTYPE)
+        return pd.array(values, dtype=STRING_DTYPE)
+    return pd.array(values)
+
+
+def columnarFrame(rows, keys, dtypes) -> pd.DataFrame:
+    # one transpose into per-column tuples, then each column is built straight
+    # into its final dtype instead of going through a 2-D object array
+    columns = zip(*rows) if rows else [()] * len(keys)
+    return pd.DataFrame(
+        {key: _column(values, dtypes.get(key)) for key, values in zip(keys, columns)},
+        copy=False,
+    )
+
+
+def compactFrame(df: pd.DataFrame, dtypes) -> pd.DataFrame:
+    if not COLUMNAR:
+        return df
+    for col, dtype in dtypes.items():
+        if col not in df.columns:
+            continue
+        if dtype == "category" and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+        elif dtype == "int32" and df[col].dtype.kind in "iu" and len(df):
+            if df[col].max() <= np.iinfo(np.int32).max and df[col].min() >= np.iinfo(np.int32).min:
+                df[col] = df[col].astype(np.int32)
+    return df
@@ -1,11 +1,16 @@
 from config import local, supa
+from ETL.loader import copyUpsert
+from ETL.schema import reflectTables
+from ETL.state import ensureStateTables, getWatermark, setWatermark, saveKeyMap
+from ETL.keymap import refreshKeyMap
+from ETL.metrics import startStage, activeBatch, record, timed
+from ETL.dates import DateParser
+from model.warehouse import ensurePartitions
 from contextlib import contextmanager
-from sqlalchemy import select, MetaData, text
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import select, func, text
 import pandas as pd
+import numpy as np
 import logging
-import itertools
-import gc
 import os
 import time
 
@@ -15,6 +20,9 @@ logging.basicConfig(
 
 BATCH_SIZE = int(os.getenv("BATCH_SIZE") or 5000)
 
+# shared with the fact stage, which parses the same delivery dates
+DELIVERY_DATES = DateParser("deliveryDate")
+
 
 @contextmanager
 def extract():
@@ -43,87 +51,111 @@ def warehouse_conn():
         logging.info("Warehouse connection closed.")
 
 
+def dayKey(dates: pd.Series) -> np.ndarray:
+    # days since 1970-01-01; the date dimension's natural key
+    return dates.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]").astype(np.int64)
+
+
+def dateId(dates: pd.Series) -> pd.Series:
+    # smart surrogate key YYYYMMDD, which FactSales is range-partitioned on
+    return (dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day).astype(np.int64)
+
+
+def parseDeliveryDates(values: pd.Series) -> pd.Series:
+    return DELIVERY_DATES.parse(values).dt.normalize()
+
+
 def cleanDateData(df: pd.DataFrame) -> pd.DataFrame:
-    df['deliveryDate'] = pd.to_datetime(df['deliveryDate'], format='mixed').dt.normalize()
+    df['deliveryDate'] = parseDeliveryDates(df['deliveryDate'])
     
     df = df.rename(columns={'deliveryDate': 'date'})
-    return df[["nat_key", "date"]]
+    df = df.dropna(subset=["date"]).drop_duplicates(subset=["date"]).reset_index(drop=True)
+    df["nat_key"] = dayKey(df["date"])
+    df["id"] = dateId(df["date"])
+    return df[["nat_key", "id", "date"]]
+
+
+def orderHighWater():
+    # taken before any dimension stage reads the source: every order up to here
+    # only references users, products and dates those stages will see
+    orders = reflectTables(local.engine, ["orders"])["orders"]
+    with extract() as session:
+        return session.execute(select(func.max(orders.c.id))).scalar()
 
 
-def extractDate():
+def extractDate(full_refresh=False, order_high=None):
     start = time.time()
-    metadata = MetaData()
-    metadata.reflect(bind=local.engine, only=["orders"])
-    orders = metadata.tables["orders"]
-    
-    target_metadata = MetaData()
-    target_metadata.reflect(bind=supa.engine, only=["Date"])
-    target_date = target_metadata.tables["Date"]
-
-    stmt = (
-        select(
-            orders.c.id.label("nat_key"),
-            orders.c.deliveryDate,
-        )
-        .execution_options(stream_results=True, yield_per=BATCH_SIZE)
-    )
+    orders = reflectTables(local.engine, ["orders"])["orders"]
+    target_date = reflectTables(supa.engine, ["Date"])["Date"]
 
     total_inserted = 0
     logging.info("Starting date data extraction.")
+    stage_metrics = startStage("date")
+
+    delta_df = pd.DataFrame(columns=['nat_key', 'surrogate_key'])
 
-    mapping_data = []
-    
     with extract() as session, warehouse_conn() as conn:
-        result = session.execute(stmt)
-
-        while True:
-            chunk = list(itertools.islice(result, BATCH_SIZE))
-            if not chunk:
-                break
-
-            df = pd.DataFrame(chunk, columns=result.keys())
-            logging.info(f"Extracted {len(df)} raw date records.")
-            
-            df = cleanDateData(df)
-            
-            if df.empty:
-                continue
-
-            insert_data = df[["date"]].drop_duplicates().to_dict(orient="records")
-            insert_stmt = insert(target_date).values(insert_data)
-            upsert_stmt = insert_stmt.on_conflict_do_update(
-                index_elements=["date"],
-                set_={
-                      "date": insert_stmt.excluded.date
-                }
-            ).returning(target_date.c.id, target_date.c.date)
-
-            result_set = conn.execute(upsert_stmt)
+        ensureStateTables(conn)
+        watermark = None if full_refresh else getWatermark(conn, "day")
+        high_water = order_high
+        if high_water is None:
+            high_water = session.execute(select(func.max(orders.c.id))).scalar()
+
+        # delivery dates repeat across many orders, so let the source collapse them
+        stmt = select(orders.c.deliveryDate).distinct().where(orders.c.id <= high_water)
+        if watermark is not None:
+            stmt = stmt.where(orders.c.id > watermark)
+            logging.info(f"Incremental date extraction from order id > {watermark}.")
+
+        batch_metrics = stage_metrics.newBatch()
+        with activeBatch(batch_metrics):
+            with timed("fetch_s"):
+                df = pd.DataFrame(session.execute(stmt).fetchall(), columns=["deliveryDate"])
+            logging.info(f"Extracted {len(df)} distinct raw delivery dates.")
+            record("rows_in", len(df))
+
+            with timed("transform_s"):
+                df = cleanDateData(df)
+
+            if not df.empty:
+                db_rows = copyUpsert(
+                    conn,
+                    target_date,
+                    df[["id", "date"]],
+                    index_elements=["date"],
+                    update_columns=["date"],
+                    returning=["id", "date"],
+                )
+                record("rows_out", len(df))
+                total_inserted += len(db_rows)
+                # facts for these days must have a partition to land in
+                ensurePartitions(conn, df["date"].min().date(), df["date"].max().date())
+
+                if db_rows:
+                    surrogate_key_df = pd.DataFrame(db_rows, columns=['id', 'date'])
+                    surrogate_key_df = surrogate_key_df.rename(columns={'id': 'surrogate_key'})
+                    surrogate_key_df['date'] = pd.to_datetime(surrogate_key_df['date'])
+
+                    merged_df = pd.merge(df, surrogate_key_df, on='date', how='inner')
+
+                    if not merged_df.empty:
+                        saveKeyMap(conn, "day", merged_df)
+                        delta_df = merged_df[['nat_key', 'surrogate_key']]
+                with timed("commit_s"):
+                    conn.commit()
+        batch_metrics.finish()
+
+        if high_water is not None and high_water != watermark:
+            setWatermark(conn, "day", high_water)
             conn.commit()
-            db_rows = result_set.fetchall()
-            total_inserted += len(db_rows)
-            
-            if db_rows:
-                surrogate_key_df = pd.DataFrame(db_rows, columns=['id', 'date'])
-                surrogate_key_df = surrogate_key_df.rename(columns={'id': 'surrogate_key'})
-                surrogate_key_df['date'] = pd.to_datetime(surrogate_key_df['date'])
-
-                merged_df = pd.merge(df, surrogate_key_df, on='date', how='inner')
-
-                if not merged_df.empty:
-                    mapping_data.append(merged_df[['nat_key', 'surrogate_key']])
-            
-            del df, chunk, db_rows, surrogate_key_df, merged_df
-            gc.collect()
-
-    mapped_df = pd.concat(mapping_data, ignore_index=True) if mapping_data else pd.DataFrame(columns=['nat_key', 'surrogate_key'])
+
+        mapped_df = refreshKeyMap(conn, "day", watermark, high_water, delta_df)
+        stage_metrics.set("dates", DELIVERY_DATES.summary())
+        stage_metrics.finish()
+
     logging.info(f"ETL completed - {total_inserted} dates, {len(mapped_df)} mappings")
     end = time.time()
     length = end - start
     
     print("Date extraction took", length, "seconds")
     return mapped_df, {"totalInserted": total_inserted, "mapping": mapped_df}
-
-
-    
-       
\ No newline at end of file
@@ -0,0 +1,120 @@
+from ETL.metrics import record
+from pandas.tseries.api import guess_datetime_format
+import numpy as np
+import pandas as pd
+import logging
+import os
+import threading
+import warnings
+
+# distinct raw date strings remembered per parser
+DATE_MEMO_LIMIT = int(os.getenv("DATE_MEMO_LIMIT") or 200_000)
+# formats tried first, always in this order; month-first like format="mixed"
+DATE_FORMATS = ["%Y-%m-%d", "%m/%d/%Y", "%Y/%m/%d", "%B %d, %Y", "%Y-%m-%d %H:%M:%S"]
+# leftover values sampled per batch to guess formats not in the list
+GUESS_SAMPLES = 20
+
+_NAT = np.datetime64("NaT", "us")
+
+
+class DateParser:
+    # pd.to_datetime(format="mixed") infers a format for every element. This
+    # parses the distinct raw values only, each known format as one vectorized
+    # pass, remembers the results across batches and only falls back to
+    # per-element inference for what no format matches.
+    def __init__(self, name, formats=DATE_FORMATS, memo_limit=DATE_MEMO_LIMIT):
+        self.name = name
+        self.memo_limit = memo_limit
+        # built-in formats, then guessed ones in the order they were found;
+        # the order never changes, so an ambiguous value like 03/04/2020 parses
+        # the same way in every batch
+        self.formats = list(formats)
+        self.hits = dict.fromkeys(formats, 0)
+        self.unparseable = 0
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def _formats(self):
+        with self._lock:
+            return list(self.formats)
+
+    def _tryFormat(self, fmt, values, todo, out):
+        parsed = pd.to_datetime(values.iloc[todo], format=fmt, errors="coerce")
+        ok = parsed.notna().to_numpy()
+        out[todo[ok]] = parsed[ok].to_numpy(dtype="datetime64[us]")
+        return todo[~ok], int(ok.sum())
+
+    def _parseNew(self, raw) -> np.ndarray:
+        values = pd.Series([v.strip() if isinstance(v, str) else v for v in raw], dtype=object)
+        out = np.full(len(raw), _NAT, dtype="datetime64[us]")
+        todo = np.arange(len(raw))
+        hits = {}
+
+        for fmt in self._formats():
+            if not len(todo):
+                break
+            todo, hits[fmt] = self._tryFormat(fmt, values, todo, out)
+
+        if len(todo):
+            with warnings.catch_warnings():
+                # day-first guesses are fine here, the format is explicit from now on
+                warnings.simplefilter("ignore", UserWarning)
+                guessed = {guess_datetime_format(v) for v in values.iloc[todo[:GUESS_SAMPLES]] if isinstance(v, str)}
+            for fmt in sorted(guessed - {None} - hits.keys()):
+                todo, count = self._tryFormat(fmt, values, todo, out)
+                if count:
+                    hits[fmt] = count
+                    logging.info(f"{self.name}: found date format {fmt!r}.")
+
+        if len(todo):
+            # odd one-offs and non-string values
+            parsed = pd.to_datetime(values.iloc[todo], format="mixed", errors="coerce")
+            ok = parsed.notna().to_numpy()
+            out[todo[ok]] = parsed[ok].to_numpy(dtype="datetime64[us]")
+            todo = todo[~ok]
+
+        with self._lock:
+            for fmt, count in hits.items():
+                if fmt not in self.hits:
+                    self.formats.append(fmt)
+                self.hits[fmt] = self.hits.get(fmt, 0) + count
+        if len(todo):
+            logging.warning(f"{self.name}: {len(todo)} unparseable values, e.g. {raw[todo[0]]!r}.")
+        return out
+
+    def parse(self, values: pd.Series) -> pd.Series:
+        if values.dtype.kind == "M":
+            return values
+        codes, uniques = pd.factorize(values)
+        uniques = list(uniques)
+
+        with self._lock:
+            parsed = [self._memo.get(value, None) for value in uniques]
+        todo = [i for i, value in enumerate(parsed) if value is None]
+        if todo:
+            raw = [uniques[i] for i in todo]
+            fresh = self._parseNew(raw)
+            with self._lock:
+                room = max(0, self.memo_limit - len(self._memo))
+                self._memo.update(zip(raw[:room], fresh[:room]))
+            for i, value in zip(todo, fresh):
+                parsed[i] = value
+
+        # unparseable strings are memoized as NaT, so count them per row
+        out = np.empty(len(parsed) + 1, dtype="datetime64[us]")
+        out[:-1] = parsed
+        out[-1] = _NAT
+        unparseable = int(np.isnat(out[:-1])[codes[codes >= 0]].sum())
+        if unparseable:
+            record("dates_unparseable", unparseable)
+            with self._lock:
+                self.unparseable += unparseable
+        return pd.Series(out[codes], index=values.index, name=values.name)
+
+    def summary(self):
+        with self._lock:
+            return {
+                "formats": {fmt: count for fmt, count in self.hits.items() if count},
+                "unparseable": self.unparseable,
+                "memo": len(self._memo),
+            }
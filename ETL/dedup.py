@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import logging
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+
+# "memory" keeps the keys in a set; "bloom" keeps them in a SQLite file on
+# disk behind an in-memory bloom filter, for runs too large for that; "off"
+# disables
+DEDUP_MODE = os.getenv("DEDUP_MODE") or "memory"
+# bloom filter sizing: expected distinct keys and acceptable false-positive rate
+DEDUP_EXPECTED = int(os.getenv("DEDUP_EXPECTED") or 50_000_000)
+DEDUP_FP_RATE = float(os.getenv("DEDUP_FP_RATE") or 1e-3)
+# where the bloom mode's key file goes (default: the system temp dir)
+DEDUP_DIR = os.getenv("DEDUP_DIR")
+
+# keys per SQLite IN (...) lookup
+_LOOKUP_CHUNK = 900
+
+
+def keyHashes(values: pd.Series) -> np.ndarray:
+    return pd.util.hash_array(values.to_numpy(dtype=object))
+
+
+class SeenKeys:
+    # Run-wide record of the keys already sent. unseen returns a mask of the
+    # keys not sent before; add marks keys once they have actually gone out.
+    # Only exact matches are ever reported as seen: in bloom mode a filter hit
+    # is just a "maybe" that the key file then confirms or rejects.
+    def __init__(self, name, mode=DEDUP_MODE, expected=DEDUP_EXPECTED, fp_rate=DEDUP_FP_RATE, directory=DEDUP_DIR):
+        if mode not in ("memory", "bloom"):
+            raise ValueError(f"Unknown dedup mode {mode!r}; expected 'memory' or 'bloom'")
+        self.name = name
+        self.mode = mode
+        self.suppressed = 0
+        self.added = 0
+        self.lookups = 0
+        self._lock = threading.Lock()
+        self._db = None
+
+        if mode == "memory":
+            self._seen = set()
+            return
+
+        # standard bloom sizing; k probes come from double hashing
+        bits = max(64, int(-expected * math.log(fp_rate) / math.log(2) ** 2))
+        self.bits = np.uint64(bits)
+        self.probes = max(1, round(bits / expected * math.log(2)))
+        self._bitmap = np.zeros((bits + 7) // 8, dtype=np.uint8)
+        self.bytes = len(self._bitmap)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd, self._path = tempfile.mkstemp(prefix=f"{name}-", suffix=".sqlite", dir=directory)
+        os.close(fd)
+        self._db = sqlite3.connect(self._path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=OFF")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("CREATE TABLE seen (key TEXT PRIMARY KEY) WITHOUT ROWID")
+        logging.info(f"{name} dedup bloom filter: {self.bytes // 1024 // 1024} MiB, {self.probes} probes, keys in {self._path}.")
+
+    def _positions(self, hashes):
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        steps = np.arange(self.probes, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            return (hashes[:, None] + steps[None, :] * h2[:, None]) % self.bits
+
+    def _bits(self, values):
+        positions = self._positions(keyHashes(values))
+        return positions >> np.uint64(3), (positions & np.uint64(7)).astype(np.uint8)
+
+    def unseen(self, values: pd.Series) -> np.ndarray:
+        keys = values.tolist()
+        if self.mode == "memory":
+            with self._lock:
+                new = np.fromiter((k not in self._seen for k in keys), dtype=bool, count=len(keys))
+        else:
+            byte, bit = self._bits(values)
+            with self._lock:
+                maybe = ((self._bitmap[byte] >> bit) & 1).all(axis=1)
+                candidates = [keys[i] for i in np.flatnonzero(maybe)]
+                found = set()
+                for start in range(0, len(candidates), _LOOKUP_CHUNK):
+                    chunk = candidates[start:start + _LOOKUP_CHUNK]
+                    found.update(k for (k,) in self._db.execute(
+                        f"SELECT key FROM seen WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                    ))
+                self.lookups += len(candidates)
+            new = np.fromiter((k not in found for k in keys), dtype=bool, count=len(keys))
+
+        with self._lock:
+            self.suppressed += len(new) - int(new.sum())
+        return new
+
+    def add(self, values: pd.Series):
+        if not len(values):
+            return
+        if self.mode == "memory":
+            with self._lock:
+                before = len(self._seen)
+                self._seen.update(values.tolist())
+                self.added += len(self._seen) - before
+            return
+
+        byte, bit = self._bits(values)
+        with self._lock:
+            np.bitwise_or.at(self._bitmap, byte.ravel(), np.left_shift(1, bit.ravel()).astype(np.uint8))
+            before = self._db.total_changes
+            self._db.executemany("INSERT OR IGNORE INTO seen VALUES (?)", ((k,) for k in values.tolist()))
+            self.added += self._db.total_changes - before
+
+    def summary(self):
+        out = {"mode": self.mode, "keys": self.added, "suppressed": self.suppressed}
+        if self.mode == "bloom":
+            out["bytes"] = self.bytes
+            out["lookups"] = self.lookups
+        return out
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+            os.remove(self._path)
@@ -1,11 +1,26 @@
 from config import local, supa
+from ETL.loader import copyUpsert
+from ETL.schema import reflectTables, conflictKey
+from ETL.state import (
+    ensureStateTables, getWatermark, setWatermark, highWater,
+    planRanges, setCheckpoint, clearCheckpoints, keyMapJoin,
+)
+from ETL.keymap import KeyMap, resolveKeys
+from ETL.date_ETL import DELIVERY_DATES, dayKey, parseDeliveryDates
+from ETL.pipeline import PIPELINE_WRITERS, readPages, runPipeline, writerConnections, writerCount
+from ETL.scheduler import maxWorkers
+from ETL.metrics import startStage, record
+from ETL.batching import BatchSizer
+from ETL.columnar import compactFrame
+from ETL.rollup import ROLLUPS, ensureRollupTables, rebuildRollups, rollupHooks
+from ETL.dedup import DEDUP_MODE, SeenKeys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from contextlib import contextmanager
-from sqlalchemy import select, MetaData, text
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import select, delete, func, text
 import pandas as pd
 import numpy as np
 import logging
-import itertools
 import gc
 import os
 import time
@@ -15,6 +30,33 @@ logging.basicConfig(
 )
 
 BATCH_SIZE = int(os.getenv("BATCH_SIZE") or 5000)
+FACT_WORKERS = int(os.getenv("FACT_WORKERS") or 1)
+# "client" resolves surrogate keys from in-memory key maps, "warehouse" ships
+# natural keys and joins them against ETLKeyMap inside Postgres
+FACT_RESOLVE = os.getenv("FACT_RESOLVE") or "client"
+
+FACT_COLUMNS = ["quantity", "revenue", "UserId", "ProductId", "LocationId", "DateId", "OrderNumber"]
+
+# fact column -> key map stage, for warehouse-side resolution
+KEY_STAGES = {"UserId": "user", "LocationId": "location", "DateId": "day", "ProductId": "product"}
+
+# compact dtypes for the COLUMNAR=1 extraction path
+SOURCE_DTYPES = {
+    "order_id": "int32",
+    "quantity": "int32",
+    "OrderNumber": "string",
+    "UserId": "int32",
+    "ProductId": "int32",
+    "LocationId": "int32",
+    "DateId": "category",
+}
+FACT_DTYPES = {
+    "quantity": "int32",
+    "UserId": "int32",
+    "ProductId": "int32",
+    "LocationId": "int32",
+    "DateId": "int32",
+}
 
 
 @contextmanager
@@ -44,7 +86,7 @@ def warehouse_conn():
         logging.info("Warehouse connection closed.")
 
 
-def cleanFactData(df: pd.DataFrame, user_map, loc_map, date_map, prod_map) -> pd.DataFrame:
+def cleanFactData(df: pd.DataFrame, key_maps, seen=None) -> pd.DataFrame:
     df = (
     df.dropna(subset=["OrderNumber"])
       .assign(
@@ -56,47 +98,121 @@ def cleanFactData(df: pd.DataFrame, user_map, loc_map, date_map, prod_map) -> pd
       .assign(revenue=lambda x: np.ceil(x['revenue'] * 100) / 100)
       .reset_index(drop=True)
     )
+
+    # order numbers already sent earlier in this run
+    if seen is not None:
+        new = seen.unseen(df["OrderNumber"])
+        record("rows_deduped", len(df) - int(new.sum()))
+        df = df[new].reset_index(drop=True)
+
+    # the date dimension is keyed by calendar day, not by order; orders
+    # without a readable delivery date have no day to resolve to
+    days = parseDeliveryDates(df['DateId'])
+    if days.isna().any():
+        df, days = df[days.notna().to_numpy()].reset_index(drop=True), days.dropna().reset_index(drop=True)
+    df['DateId'] = dayKey(days)
     
-    merge_info = [
-      ('UserId', user_map),
-      ('LocationId', loc_map),
-      ('DateId', date_map),
-      ('ProductId', prod_map)
-    ]
-    
-    for col, dim_df in merge_info:
-        n_to_s = dim_df
-        mapped = df[col].map(n_to_s)
-
-        mask = mapped.notna()
-        df = df.loc[mask].copy()
-        
-        df[col] = mapped.loc[mask].astype('int64')
-    
+    # without key maps the natural keys go out as-is for the warehouse to resolve
+    if key_maps is not None:
+        df = resolveKeys(df, key_maps)
+        # only rows that kept all their keys count as sent; the warehouse path
+        # marks them once the key map join has run
+        if seen is not None:
+            seen.add(df["OrderNumber"])
+
     return df[["quantity","revenue","OrderNumber","UserId","LocationId","DateId","ProductId"]]
 
 
-def extractFact(user_df, loc_df, date_df, prod_df):
+def orderRanges(low, high, parts):
+    # half-open (start, end] slices of orders.id
+    step = max(1, -(-(high - low) // parts))
+    return [(start, min(start + step, high)) for start in range(low, high, step)]
+
+
+def dropMovedOrders(conn, facts, staging):
+    # with DateId in the conflict key an order whose delivery date changed is
+    # inserted into its new partition; drop the row left behind in the old one
+    older = facts.alias("older")
+    conn.execute(delete(older).where(
+        older.c.OrderNumber == staging.c.OrderNumber,
+        facts.c.OrderNumber == older.c.OrderNumber,
+        facts.c.id > older.c.id,
+    ))
+
+
+def loadFactRange(stmt, orders, target_facts, key_maps, low, high, stage_metrics=None, sizer=None, seen=None, writers=PIPELINE_WRITERS):
+    label = f"orders ({low}, {high}]"
+    source = partial(keyMapJoin, key_stages=KEY_STAGES) if key_maps is None else None
+    # (OrderNumber) on a plain FactSales, (OrderNumber, DateId) on a partitioned one
+    index_elements = conflictKey(target_facts, "OrderNumber")
+    update_columns = [c for c in FACT_COLUMNS if c not in index_elements]
+    before, rollup_after = rollupHooks(["OrderNumber"]) if ROLLUPS else (None, None)
+
+    def after(conn, staging):
+        if "DateId" in index_elements:
+            dropMovedOrders(conn, target_facts, staging)
+        if rollup_after is not None:
+            rollup_after(conn, staging)
+        if seen is not None and key_maps is None:
+            # staging holds just the rows the ETLKeyMap join resolved
+            seen.add(pd.Series(conn.execute(select(staging.c.OrderNumber)).scalars().all(), dtype=object))
+
+    with extract() as session, warehouse_conn() as conn:
+        def transform(df):
+            batch_high = highWater(None, df["order_id"])
+            return compactFrame(cleanFactData(df, key_maps, seen), FACT_DTYPES), batch_high
+
+        def load(conn, df):
+            if df.empty:
+                return 0
+            loaded = copyUpsert(
+                conn,
+                target_facts,
+                df[FACT_COLUMNS],
+                index_elements=index_elements,
+                update_columns=update_columns,
+                source=source,
+                before=before,
+                after=after,
+            )
+            record("rows_out", loaded)
+            logging.info(f"Loaded {loaded} records for {label}.")
+            gc.collect()
+            return loaded
+
+        def checkpoint(conn, position):
+            setCheckpoint(conn, "fact", high, position)
+
+        batch_size = sizer.current if sizer is not None else BATCH_SIZE
+        reader = readPages(session, stmt, orders.c.id, low, high, batch_size, SOURCE_DTYPES)
+        with writerConnections(conn, writers) as connections:
+            total_inserted = runPipeline(
+                reader, transform, load, connections,
+                metrics=stage_metrics, sizer=sizer, checkpoint=checkpoint,
+            )
+
+    return total_inserted
+
+
+def extractFact(user_df, loc_df, date_df, prod_df, full_refresh=False, workers=None, resume=True, resolve=None):
     start = time.time()
-    metadata = MetaData()
-    metadata.reflect(bind=local.engine, only=["orderitems","users","products","orders"])
-    oitems = metadata.tables["orderitems"]
-    users = metadata.tables["users"]
-    orders = metadata.tables["orders"]
-    products = metadata.tables["products"]
-
-    target_metadata = MetaData()
-    target_metadata.reflect(bind=supa.engine, only=["FactSales"])
-    target_facts = target_metadata.tables["FactSales"]
+    source_tables = reflectTables(local.engine, ["orderitems","users","products","orders"])
+    oitems = source_tables["orderitems"]
+    users = source_tables["users"]
+    orders = source_tables["orders"]
+    products = source_tables["products"]
+
+    target_facts = reflectTables(supa.engine, ["FactSales"])["FactSales"]
     stmt = (
         select(
+                orders.c.id.label('order_id'),
                 oitems.c.quantity,
                 (oitems.c.quantity * products.c.price).label('revenue'),
                 orders.c.orderNumber.label('OrderNumber'),
                 users.c.id.label('UserId'),
                 products.c.id.label('ProductId'),
                 users.c.id.label('LocationId'),
-                orders.c.id.label('DateId')    
+                orders.c.deliveryDate.label('DateId'),
             ).join(
                 orders, oitems.c.OrderId == orders.c.id
             ).join(
@@ -104,48 +220,96 @@ def extractFact(user_df, loc_df, date_df, prod_df):
             ).join(
                 users, orders.c.userId == users.c.id
             )
-        ).execution_options(stream_results=True, yield_per=BATCH_SIZE)
+        )
 
     total_inserted = 0
     logging.info("Starting fact data extraction.")
+    stage_metrics = startStage("fact")
+    # shared by all range workers so they converge on one size
+    sizer = BatchSizer("fact")
 
     with extract() as session, warehouse_conn() as conn:
-        result = session.execute(stmt)
-
-        user_map = dict(zip(user_df['nat_key'], user_df['surrogate_key']))
-        loc_map = dict(zip(loc_df['nat_key'], loc_df['surrogate_key']))
-        date_map = dict(zip(date_df['nat_key'], date_df['surrogate_key']))
-        prod_map = dict(zip(prod_df['nat_key'], prod_df['surrogate_key']))
-        
-        while True:
-            chunk = list(itertools.islice(result, BATCH_SIZE))
-            if not chunk:
-                break
-
-            df = pd.DataFrame(chunk, columns=result.keys())
-            df = cleanFactData(df, user_map, loc_map, date_map, prod_map)
-            if df.empty:
-                continue
-            insert_data = df[["quantity", "revenue", "UserId", "ProductId", "LocationId", "DateId", "OrderNumber"]].to_dict(orient="records")
-            insert_stmt = insert(target_facts).values(insert_data)
-            upsert_stmt = insert_stmt.on_conflict_do_update(
-                index_elements=["OrderNumber"],
-                set_={
-                    "quantity": insert_stmt.excluded.quantity,
-                    "revenue": insert_stmt.excluded.revenue,
-                    "UserId": insert_stmt.excluded.UserId,
-                    "ProductId": insert_stmt.excluded.ProductId,
-                    "LocationId": insert_stmt.excluded.LocationId,
-                    "DateId": insert_stmt.excluded.DateId,
-                },
-            )
-            conn.execute(upsert_stmt)
+        ensureStateTables(conn)
+        watermark = None if full_refresh else getWatermark(conn, "fact")
+        low, high = session.execute(select(func.min(orders.c.id) - 1, func.max(orders.c.id))).one()
+        if watermark is not None:
+            low = watermark
+        # Orders past the date stage's high-water may reference dimension rows
+        # loaded after the key maps were taken; they would be dropped as
+        # unresolved and the watermark would move past them for good.
+        day_high = getWatermark(conn, "day")
+        if high is not None and day_high is not None and day_high < high:
+            logging.info(f"Capping fact extraction at order id {day_high}, the date stage's high-water.")
+            high = day_high
+
+        # each worker holds its own source session and warehouse connection
+        workers = max(1, min(workers or FACT_WORKERS, maxWorkers()))
+        ranges = orderRanges(low, high, workers) if high is not None and low < high else []
+        ranges, high_water, resumed = planRanges(conn, "fact", ranges, resume)
+        conn.commit()
+
+        # new summary tables start from the facts already in the warehouse
+        if ROLLUPS and ensureRollupTables(conn):
+            rebuildRollups(conn)
+
+    if resumed:
+        logging.info(f"Resuming fact extraction for {len(ranges)} unfinished order id ranges.")
+    elif watermark is not None and ranges:
+        logging.info(f"Incremental fact extraction from order id > {watermark}.")
+
+    resolve = resolve or FACT_RESOLVE
+    stage_metrics.set("resolve", resolve)
+    if ranges:
+        key_maps = None
+        if resolve != "warehouse":
+            key_maps = {
+                'UserId': KeyMap.fromFrame(user_df),
+                'LocationId': KeyMap.fromFrame(loc_df),
+                'DateId': KeyMap.fromFrame(date_df),
+                'ProductId': KeyMap.fromFrame(prod_df),
+            }
+
+        logging.info(f"Loading facts for order ids up to {high_water} with {len(ranges)} workers.")
+        stage_metrics.set("workers", len(ranges))
+        writers = writerCount(len(ranges))
+        if writers < PIPELINE_WRITERS:
+            logging.info(f"Using {writers} writers per worker to stay within the warehouse pool.")
+        stage_metrics.set("writers", writers)
+        # shared by all range workers: an order number goes out once per run
+        seen = SeenKeys("OrderNumber") if DEDUP_MODE != "off" else None
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix="fact") as pool:
+            futures = {
+                pool.submit(loadFactRange, stmt, orders, target_facts, key_maps, range_low, range_high, stage_metrics, sizer, seen, writers): (range_low, range_high)
+                for range_low, range_high in ranges
+            }
+            for future in as_completed(futures):
+                range_low, range_high = futures[future]
+                try:
+                    total_inserted += future.result()
+                except Exception as e:
+                    logging.error(f"Fact load for orders ({range_low}, {range_high}] failed: {e}")
+                    errors.append(e)
+
+        if seen is not None:
+            stage_metrics.set("dedup", seen.summary())
+            logging.info(f"Suppressed {seen.suppressed} order numbers already loaded in this run.")
+            seen.close()
+
+        if errors:
+            raise errors[0]
+
+    if high_water is not None:
+        with warehouse_conn() as conn:
+            clearCheckpoints(conn, "fact")
+            if high_water != watermark:
+                setWatermark(conn, "fact", high_water)
             conn.commit()
-            total_inserted += len(df)
-            logging.info(f"Processed {total_inserted} records so far.")
-            del df, chunk
-            gc.collect()
 
+    stage_metrics.set("batch_size", sizer.summary())
+    stage_metrics.set("dates", DELIVERY_DATES.summary())
+    stage_metrics.finish()
     logging.info(
         f"ETL completed successfully — totalInserted = {
             total_inserted}"
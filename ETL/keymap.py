@@ -0,0 +1,198 @@
+from config import supa
+from ETL.state import ensureStateTables, getWatermark, loadKeyMap
+import numpy as np
+import pandas as pd
+import logging
+import json
+import os
+import shutil
+import time
+
+KEYMAP_DIR = os.getenv("KEYMAP_DIR") or ".keymaps"
+KEYMAP_KEEP = int(os.getenv("KEYMAP_KEEP") or 3)
+RUN_ID = os.getenv("RUN_ID") or time.strftime("%Y%m%dT%H%M%S")
+# use a dense array indexed by nat_key when it wastes at most this many slots per key
+DENSE_FACTOR = float(os.getenv("KEYMAP_DENSE_FACTOR") or 2)
+
+MISSING = -1
+
+
+def _compact(values: np.ndarray) -> np.ndarray:
+    if len(values) and values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max:
+        return values.astype(np.int32)
+    return values
+
+
+class KeyMap:
+    def __init__(self, nat_keys, surrogate_keys):
+        nat_keys = np.asarray(nat_keys, dtype=np.int64)
+        surrogate_keys = np.asarray(surrogate_keys, dtype=np.int64)
+
+        if len(nat_keys) > 1 and not np.all(nat_keys[1:] >= nat_keys[:-1]):
+            order = np.argsort(nat_keys, kind="stable")
+            nat_keys, surrogate_keys = nat_keys[order], surrogate_keys[order]
+        if len(nat_keys) > 1:
+            # keep the last surrogate of any repeated nat_key, like mergeKeyMaps
+            last = np.r_[nat_keys[1:] != nat_keys[:-1], True]
+            nat_keys, surrogate_keys = nat_keys[last], surrogate_keys[last]
+
+        self.size = len(nat_keys)
+        self._base = int(nat_keys[0]) if self.size else 0
+        span = int(nat_keys[-1]) - self._base + 1 if self.size else 0
+
+        if self.size and span <= DENSE_FACTOR * self.size:
+            dense = np.full(span, MISSING, dtype=np.int64)
+            dense[nat_keys - self._base] = surrogate_keys
+            self._dense = _compact(dense)
+            self._keys = self._values = None
+        else:
+            self._dense = None
+            self._keys = _compact(nat_keys)
+            self._values = _compact(surrogate_keys)
+
+    @classmethod
+    def fromFrame(cls, df: pd.DataFrame):
+        return cls(df["nat_key"].to_numpy(), df["surrogate_key"].to_numpy())
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        if self._dense is not None:
+            return self._dense.nbytes
+        return self._keys.nbytes + self._values.nbytes
+
+    def lookup(self, keys):
+        keys = np.asarray(keys)
+        if keys.dtype.kind in "iu":
+            valid = np.ones(len(keys), dtype=bool)
+            keys = keys.astype(np.int64, copy=False)
+        else:
+            valid = ~pd.isna(keys)
+            ints = np.zeros(len(keys), dtype=np.int64)
+            ints[valid] = keys[valid].astype(np.int64)
+            keys = ints
+
+        values = np.full(len(keys), MISSING, dtype=np.int64)
+        if not self.size:
+            return values, np.zeros(len(keys), dtype=bool)
+
+        if self._dense is not None:
+            idx = keys - self._base
+            found = valid & (idx >= 0) & (idx < len(self._dense))
+            values[found] = self._dense[idx[found]]
+            found &= values != MISSING
+        else:
+            pos = np.searchsorted(self._keys, keys)
+            pos[pos == len(self._keys)] = 0
+            found = valid & (self._keys[pos] == keys)
+            values[found] = self._values[pos[found]]
+        return values, found
+
+
+def emptyKeyMap() -> pd.DataFrame:
+    return pd.DataFrame(columns=["nat_key", "surrogate_key"])
+
+
+def mergeKeyMaps(base: pd.DataFrame, delta: pd.DataFrame) -> pd.DataFrame:
+    if delta.empty:
+        return base
+    merged = pd.concat([base, delta], ignore_index=True)
+    return merged.drop_duplicates(subset=["nat_key"], keep="last").reset_index(drop=True)
+
+
+def _stageDir(stage):
+    return os.path.join(KEYMAP_DIR, stage)
+
+
+def _readMeta(stage):
+    path = os.path.join(_stageDir(stage), "CURRENT")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def loadCachedKeyMap(stage, watermark=None):
+    meta = _readMeta(stage)
+    if meta is None:
+        return None
+    if watermark is not None and meta["watermark"] != watermark:
+        logging.info(f"Cached {stage} key map is at {meta['watermark']}, warehouse at {watermark}; ignoring cache.")
+        return None
+
+    version_dir = os.path.join(_stageDir(stage), meta["version"])
+    nat_keys = np.load(os.path.join(version_dir, "nat_key.npy"), mmap_mode="r")
+    surrogate_keys = np.load(os.path.join(version_dir, "surrogate_key.npy"), mmap_mode="r")
+    return pd.DataFrame({"nat_key": nat_keys, "surrogate_key": surrogate_keys}, copy=False)
+
+
+def saveCachedKeyMap(stage, mapping: pd.DataFrame, watermark):
+    stage_dir = _stageDir(stage)
+    version_dir = os.path.join(stage_dir, RUN_ID)
+    os.makedirs(version_dir, exist_ok=True)
+
+    mapping = mapping.sort_values("nat_key")
+    np.save(os.path.join(version_dir, "nat_key.npy"), mapping["nat_key"].to_numpy(dtype="int64"))
+    np.save(os.path.join(version_dir, "surrogate_key.npy"), mapping["surrogate_key"].to_numpy(dtype="int64"))
+
+    # readers only ever follow CURRENT, so swapping it last keeps every version consistent
+    tmp_path = os.path.join(stage_dir, "CURRENT.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"version": RUN_ID, "watermark": watermark, "rows": len(mapping)}, f)
+    os.replace(tmp_path, os.path.join(stage_dir, "CURRENT"))
+
+    versions = sorted(
+        (d for d in os.listdir(stage_dir) if os.path.isdir(os.path.join(stage_dir, d))),
+        key=lambda d: os.path.getmtime(os.path.join(stage_dir, d)),
+    )
+    for old in versions[:-KEYMAP_KEEP]:
+        shutil.rmtree(os.path.join(stage_dir, old), ignore_errors=True)
+
+
+def refreshKeyMap(conn, stage, watermark, high_water, delta: pd.DataFrame, resumed=False) -> pd.DataFrame:
+    cached = None
+    if resumed:
+        # the delta misses the batches committed before the restart, the
+        # warehouse copy has all of them
+        mapped = loadKeyMap(conn, stage)
+    elif watermark is None:
+        mapped = delta
+    else:
+        # the delta only covers rows beyond the watermark; facts need all of them
+        cached = loadCachedKeyMap(stage, watermark)
+        if cached is None:
+            mapped = loadKeyMap(conn, stage)
+        else:
+            mapped = mergeKeyMaps(cached, delta)
+
+    if high_water is not None and (cached is None or not delta.empty):
+        saveCachedKeyMap(stage, mapped, high_water)
+    return mapped
+
+
+def resolveKeys(df: pd.DataFrame, key_maps) -> pd.DataFrame:
+    mask = np.ones(len(df), dtype=bool)
+    resolved = {}
+    for col, key_map in key_maps.items():
+        resolved[col], found = key_map.lookup(df[col].to_numpy())
+        mask &= found
+
+    df = df.loc[mask].copy()
+    for col, values in resolved.items():
+        df[col] = values[mask]
+    return df
+
+
+def currentKeyMap(stage) -> pd.DataFrame:
+    # the cache is only good if it was written at the watermark the warehouse
+    # is at; another host or a run without the cache may have moved it since
+    with supa.engine.connect() as conn:
+        ensureStateTables(conn)
+        watermark = getWatermark(conn, stage)
+        cached = loadCachedKeyMap(stage, watermark) if watermark is not None else None
+        if cached is not None:
+            return cached
+        logging.info(f"No current cached {stage} key map; reading it from the warehouse.")
+        return loadKeyMap(conn, stage)
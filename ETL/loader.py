@@ -0,0 +1,104 @@
+from ETL.metrics import record, timed
+from sqlalchemy import and_, column, or_, select, table, text
+from sqlalchemy.dialects.postgresql import insert
+import pandas as pd
+import io
+import os
+
+NULL_MARKER = "\\N"
+# leave conflicting rows alone when none of the update columns changed
+SKIP_UNCHANGED = (os.getenv("SKIP_UNCHANGED") or "1") != "0"
+
+
+def stagingName(target):
+    return f"_stage_{target.name.lower()}"
+
+
+def createStaging(conn, target, columns, name=None):
+    quote = conn.dialect.identifier_preparer.quote
+    name = name or stagingName(target)
+    cols = ", ".join(quote(c) for c in columns)
+    # temp tables skip the WAL and vanish with the transaction that loaded them
+    conn.execute(text(
+        f"CREATE TEMP TABLE {quote(name)} ON COMMIT DROP AS "
+        f"SELECT {cols} FROM {quote(target.name)} WITH NO DATA"
+    ))
+    return table(name, *[column(c) for c in columns])
+
+
+def copyFrame(conn, staging, df: pd.DataFrame) -> int:
+    quote = conn.dialect.identifier_preparer.quote
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False, na_rep=NULL_MARKER)
+    size = buf.tell()
+    buf.seek(0)
+
+    cols = ", ".join(quote(c) for c in df.columns)
+    record("bytes_sent", size)
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {quote(staging.name)} ({cols}) FROM STDIN WITH (FORMAT csv, NULL '{NULL_MARKER}')",
+            buf,
+        )
+    finally:
+        cursor.close()
+    return size
+
+
+def copyUpsert(conn, target, df: pd.DataFrame, index_elements, update_columns, returning=None,
+               skip_unchanged=SKIP_UNCHANGED, source=None, before=None, after=None):
+    # source(staging, columns) may replace the plain SELECT from the staging
+    # table, e.g. to resolve keys with joins inside the warehouse; its rows
+    # land in a second staging table that the upsert and hooks then read.
+    # before/after(conn, staging) run in the same transaction around the upsert.
+    # Returns the RETURNING rows, or without returning the number of rows
+    # that reached the upsert.
+    columns = list(df.columns)
+    # ON CONFLICT cannot touch the same row twice in one statement
+    df = df.drop_duplicates(subset=index_elements, keep="last")
+
+    with timed("write_s"):
+        staging = createStaging(conn, target, columns)
+        copyFrame(conn, staging, df)
+        staged = len(df)
+        if source is not None:
+            # rows the source drops (e.g. unresolved keys) never reach the upsert
+            resolved = createStaging(conn, target, columns, stagingName(target) + "_resolved")
+            staged = max(conn.execute(insert(resolved).from_select(columns, source(staging, columns))).rowcount, 0)
+            staging = resolved
+
+        # concurrent writers touch conflicting rows in the same order, so two
+        # upserts wait on each other instead of deadlocking
+        rows = select(*[staging.c[c] for c in columns]).order_by(*[staging.c[c] for c in index_elements])
+        insert_stmt = insert(target).from_select(columns, rows)
+        changed = None
+        if skip_unchanged:
+            # an update that rewrites identical values still leaves a dead tuple,
+            # WAL and index churn behind
+            changed = or_(*[target.c[c].is_distinct_from(insert_stmt.excluded[c]) for c in update_columns])
+        upsert_stmt = insert_stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={c: insert_stmt.excluded[c] for c in update_columns},
+            where=changed,
+        )
+        if returning and not skip_unchanged:
+            upsert_stmt = upsert_stmt.returning(*[target.c[c] for c in returning])
+
+        if before is not None:
+            before(conn, staging)
+        result = conn.execute(upsert_stmt)
+        record("rows_changed", max(result.rowcount, 0))
+        if after is not None:
+            after(conn, staging)
+        if not returning:
+            return staged
+        if not skip_unchanged:
+            return result.fetchall()
+
+        # RETURNING skips the rows the guard left alone, but the key map needs
+        # every surrogate key, so read them back through the staging table
+        matched = and_(*[target.c[c] == staging.c[c] for c in index_elements])
+        return conn.execute(
+            select(*[target.c[c] for c in returning]).select_from(target.join(staging, matched))
+        ).fetchall()
@@ -1,10 +1,21 @@
 from config import local, supa
+from ETL.loader import copyUpsert
+from ETL.schema import reflectTables
+from ETL.state import (
+    ensureStateTables, getWatermark, setWatermark, saveKeyMap, highWater,
+    planRanges, setCheckpoint, clearCheckpoints,
+)
+from ETL.keymap import refreshKeyMap
+from ETL.pipeline import readPages, runPipeline, writerConnections, writerCount
+from ETL.scheduler import maxWorkers
+from ETL.metrics import startStage, record
+from ETL.batching import BatchSizer
+from ETL.offload import offload
+from ETL.cleaning import Cleaner
 from contextlib import contextmanager
-from sqlalchemy import select, MetaData, text
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import select, func, text
 import pandas as pd
 import logging
-import itertools
 import gc
 import os
 import time
@@ -15,6 +26,22 @@ logging.basicConfig(
 
 BATCH_SIZE = int(os.getenv("BATCH_SIZE") or 5000)
 
+# compact dtypes for the COLUMNAR=1 extraction path
+SOURCE_DTYPES = {
+    "nat_key": "int32",
+    "address1": "string",
+    "address2": "string",
+    "city": "category",
+    "country": "category",
+    "zipCode": "string",
+}
+
+# rules run on each column's distinct values only, memoized across batches
+CLEANER = Cleaner({
+    col: lambda s: s.str.strip().str.title()
+    for col in ["city", "country"]
+})
+
 
 @contextmanager
 def extract():
@@ -47,23 +74,17 @@ def cleanLocationData(df: pd.DataFrame) -> pd.DataFrame:
     df = df.dropna(subset=["address1", "address2", "city", "country", "zipCode"]).copy()
     df["address1"] = df["address1"].str.strip().str.title()
     df["address2"] = df["address2"].str.strip().str.title()
-    df["city"] = df["city"].str.strip().str.title()
-    df["country"] = df["country"].str.strip().str.title()
-    df["zipCode"] = df["zipCode"].str.strip().str.title()   
+    df["zipCode"] = df["zipCode"].str.strip().str.title()
+    df = CLEANER.apply(df)
 
     df = df.drop_duplicates(subset=["address1", "address2", "city"]).reset_index(drop=True)
     return df[["nat_key", "address1", "address2", "city", "country", "zipCode"]]
 
 
-def extractLocation():
+def extractLocation(full_refresh=False, resume=True):
     start = time.time()
-    metadata = MetaData()
-    metadata.reflect(bind=local.engine, only=["users"])
-    users = metadata.tables["users"]
-    
-    target_metadata = MetaData()
-    target_metadata.reflect(bind=supa.engine, only=["Location"])
-    target_locs = target_metadata.tables["Location"]
+    users = reflectTables(local.engine, ["users"])["users"]
+    target_locs = reflectTables(supa.engine, ["Location"])["Location"]
 
     stmt = (
         select(
@@ -74,44 +95,49 @@ def extractLocation():
             users.c.country,
             users.c.zipCode,
         )
-        .execution_options(stream_results=True, yield_per=BATCH_SIZE)
     )
 
     total_inserted = 0
     logging.info("Starting location data extraction.")
+    stage_metrics = startStage("location")
+    sizer = BatchSizer("location")
 
     mapping_data = []
 
     with extract() as session, warehouse_conn() as conn:
-        result = session.execute(stmt)
-
-        while True:
-            chunk = list(itertools.islice(result, BATCH_SIZE))
-            if not chunk:
-                break
-
-            df = pd.DataFrame(chunk, columns=result.keys())
+        ensureStateTables(conn)
+        watermark = None if full_refresh else getWatermark(conn, "location")
+        low, high = session.execute(select(func.min(users.c.id) - 1, func.max(users.c.id))).one()
+        if watermark is not None:
+            low = watermark
+        ranges = [(low, high)] if high is not None and low < high else []
+        ranges, high_water, resumed = planRanges(conn, "location", ranges, resume)
+        conn.commit()
+        if resumed:
+            logging.info(f"Resuming location extraction from checkpoint {ranges}.")
+        elif watermark is not None:
+            logging.info(f"Incremental location extraction from id > {watermark}.")
+        if high_water is None:
+            high_water = watermark
+
+        def transform(df):
             logging.info(f"Extracted {len(df)} raw location records.")
-            
-            df = cleanLocationData(df)
-            
+            return offload(cleanLocationData, df, SOURCE_DTYPES), highWater(None, df["nat_key"])
+
+        def load(conn, df):
             if df.empty:
-                continue
+                return 0
 
-            insert_data = df[["address1", "address2", "city", "country", "zipCode"]].to_dict(orient="records")
-            insert_stmt = insert(target_locs).values(insert_data)
-            upsert_stmt = insert_stmt.on_conflict_do_update(
+            db_rows = copyUpsert(
+                conn,
+                target_locs,
+                df[["address1", "address2", "city", "country", "zipCode"]],
                 index_elements=["address1", "address2", "city"],
-                set_={
-                    "country": insert_stmt.excluded.country,
-                    "zipCode": insert_stmt.excluded.zipCode,
-                },
-            ).returning(target_locs.c.id, target_locs.c.address1, target_locs.c.address2, target_locs.c.city)
-
-            result_set = conn.execute(upsert_stmt)
-            conn.commit()
-            db_rows = result_set.fetchall()
-            
+                update_columns=["country", "zipCode"],
+                returning=["id", "address1", "address2", "city"],
+            )
+            record("rows_out", len(df))
+
             if db_rows:
                 surrogate_key_df = pd.DataFrame(db_rows, columns=['id', 'address1', 'address2', 'city'])
                 surrogate_key_df = surrogate_key_df.rename(columns={'id': 'surrogate_key'})
@@ -119,17 +145,33 @@ def extractLocation():
                 merged_df = pd.merge(df, surrogate_key_df, on=['address1','address2','city'], how='inner')
 
                 if not merged_df.empty:
+                    saveKeyMap(conn, "location", merged_df)
                     mapping_data.append(merged_df[['nat_key', 'surrogate_key']])
-            
-            total_inserted += len(df)
-            del df, chunk, db_rows
-            if 'surrogate_key_df' in locals():
-                del surrogate_key_df
-            if 'merged_df' in locals():
-                del merged_df
-            gc.collect()
 
-    mapped_df = pd.concat(mapping_data, ignore_index=True) if mapping_data else pd.DataFrame(columns=['nat_key', 'surrogate_key'])
+            gc.collect()
+            return len(df)
+
+        def checkpoint(conn, position):
+            setCheckpoint(conn, "location", high_water, position)
+
+        # dimension stages may all be running at once
+        with writerConnections(conn, writerCount(maxWorkers())) as connections:
+            for range_low, range_high in ranges:
+                reader = readPages(session, stmt, users.c.id, range_low, range_high, sizer.current, SOURCE_DTYPES)
+                total_inserted += runPipeline(
+                    reader, transform, load, connections,
+                    metrics=stage_metrics, sizer=sizer, checkpoint=checkpoint,
+                )
+
+        clearCheckpoints(conn, "location")
+        if high_water != watermark:
+            setWatermark(conn, "location", high_water)
+        conn.commit()
+
+        delta_df = pd.concat(mapping_data, ignore_index=True) if mapping_data else pd.DataFrame(columns=['nat_key', 'surrogate_key'])
+        mapped_df = refreshKeyMap(conn, "location", watermark, high_water, delta_df, resumed)
+        stage_metrics.set("batch_size", sizer.summary())
+        stage_metrics.finish()
     logging.info(f"ETL completed - {total_inserted} locations, {len(mapped_df)} mappings")
     end = time.time()
     length = end - start
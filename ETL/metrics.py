@@ -0,0 +1,229 @@
+from contextlib import contextmanager
+import logging
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+METRICS_PATH = os.getenv("METRICS_PATH") or "etl_metrics.json"
+METRICS_PROM_PATH = os.getenv("METRICS_PROM_PATH")
+# how often RSS is sampled while a batch or benchmark phase is running
+RSS_SAMPLE_S = float(os.getenv("RSS_SAMPLE_S") or 0.05)
+
+BATCH_FIELDS = (
+    "fetch_s", "transform_s", "write_s", "commit_s",
+    "keys_in", "rows_in", "rows_out", "rows_changed", "rows_deduped", "bytes_sent",
+    "dates_unparseable",
+)
+
+_current = threading.local()
+_stages = {}
+_lock = threading.Lock()
+_run_started = time.time()
+
+
+def peakRssBytes():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def currentRssBytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return peakRssBytes()
+
+
+class RssWindow:
+    # Peak RSS over one span of time. ru_maxrss only ever grows over the
+    # process lifetime, so a shared thread samples the current RSS while any
+    # window is open; spikes shorter than RSS_SAMPLE_S can slip through.
+    _open = set()
+    _lock = threading.Lock()
+    _sampler = None
+
+    def __init__(self):
+        self.peak = currentRssBytes()
+        cls = RssWindow
+        with cls._lock:
+            cls._open.add(self)
+            if cls._sampler is None:
+                cls._sampler = threading.Thread(target=cls._sample, name="rss-sampler", daemon=True)
+                cls._sampler.start()
+
+    @classmethod
+    def _sample(cls):
+        while True:
+            time.sleep(RSS_SAMPLE_S)
+            rss = currentRssBytes()
+            with cls._lock:
+                if not cls._open:
+                    cls._sampler = None
+                    return
+                for window in cls._open:
+                    window.peak = max(window.peak, rss)
+
+    def close(self):
+        rss = currentRssBytes()
+        with RssWindow._lock:
+            RssWindow._open.discard(self)
+            self.peak = max(self.peak, rss)
+        return self.peak
+
+
+class BatchMetrics:
+    def __init__(self, index, **values):
+        self.index = index
+        self.values = dict.fromkeys(BATCH_FIELDS, 0)
+        self.values.update(values)
+        self.rss_peak_bytes = None
+        self.window = None
+
+    def add(self, field, value):
+        self.values[field] += value
+
+    def finish(self):
+        self.rss_peak_bytes = self.window.close() if self.window is not None else currentRssBytes()
+
+    def asDict(self):
+        out = {"batch": self.index, **self.values}
+        out["rows_dropped"] = max(0, out["rows_in"] - out["rows_out"])
+        out["rss_peak_bytes"] = self.rss_peak_bytes
+        return out
+
+
+class StageMetrics:
+    def __init__(self, stage):
+        self.stage = stage
+        self.batches = []
+        self.extra = {}
+        self.started = time.time()
+        self.finished = None
+        # stays "incomplete" in the summary unless the stage reaches finish()
+        self.status = "incomplete"
+        self._lock = threading.Lock()
+
+    def newBatch(self, **values):
+        with self._lock:
+            batch = BatchMetrics(len(self.batches), **values)
+            batch.window = RssWindow()
+            self.batches.append(batch)
+        return batch
+
+    def set(self, key, value):
+        self.extra[key] = value
+
+    def finish(self, status="ok"):
+        self.finished = time.time()
+        self.status = status
+
+    def summary(self):
+        batches = [b.asDict() for b in self.batches]
+        totals = {field: sum(b[field] for b in batches) for field in BATCH_FIELDS}
+        totals["rows_dropped"] = sum(b["rows_dropped"] for b in batches)
+        end = self.finished or time.time()
+        return {
+            "stage": self.stage,
+            "status": self.status,
+            "seconds": round(end - self.started, 4),
+            "batch_count": len(batches),
+            "totals": totals,
+            "rss_peak_bytes": max((b["rss_peak_bytes"] or 0 for b in batches), default=peakRssBytes()),
+            **self.extra,
+            "batches": batches,
+        }
+
+
+def startStage(stage):
+    metrics = StageMetrics(stage)
+    with _lock:
+        _stages[stage] = metrics
+    return metrics
+
+
+def currentBatch():
+    return getattr(_current, "batch", None)
+
+
+@contextmanager
+def activeBatch(batch):
+    previous = currentBatch()
+    _current.batch = batch
+    try:
+        yield batch
+    finally:
+        _current.batch = previous
+
+
+@contextmanager
+def timed(field):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        batch = currentBatch()
+        if batch is not None:
+            batch.add(field, time.perf_counter() - started)
+
+
+def record(field, value):
+    batch = currentBatch()
+    if batch is not None:
+        batch.add(field, value)
+
+
+def runSummary():
+    with _lock:
+        stages = [m.summary() for m in _stages.values()]
+    return {
+        "started_at": _run_started,
+        "seconds": round(time.time() - _run_started, 4),
+        "rss_peak_bytes": peakRssBytes(),
+        "stages": stages,
+    }
+
+
+def _promLines(summary):
+    lines = [
+        "# TYPE etl_run_seconds gauge",
+        f"etl_run_seconds {summary['seconds']}",
+        "# TYPE etl_rss_peak_bytes gauge",
+        f"etl_rss_peak_bytes {summary['rss_peak_bytes']}",
+        "# TYPE etl_stage_seconds gauge",
+        "# TYPE etl_stage_phase_seconds gauge",
+        "# TYPE etl_stage_rows gauge",
+        "# TYPE etl_stage_bytes_sent gauge",
+        "# TYPE etl_stage_batches gauge",
+    ]
+    for stage in summary["stages"]:
+        name = stage["stage"]
+        totals = stage["totals"]
+        lines.append(f'etl_stage_seconds{{stage="{name}"}} {stage["seconds"]}')
+        for phase in ("fetch", "transform", "write", "commit"):
+            lines.append(f'etl_stage_phase_seconds{{stage="{name}",phase="{phase}"}} {totals[phase + "_s"]}')
+        for kind in ("in", "out", "changed", "deduped", "dropped"):
+            lines.append(f'etl_stage_rows{{stage="{name}",kind="{kind}"}} {totals["rows_" + kind]}')
+        lines.append(f'etl_stage_bytes_sent{{stage="{name}"}} {totals["bytes_sent"]}')
+        lines.append(f'etl_stage_batches{{stage="{name}"}} {stage["batch_count"]}')
+    return lines
+
+
+def writeRunSummary(path=None, prom_path=None):
+    summary = runSummary()
+    path = path or METRICS_PATH
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=2)
+    logging.info(f"Run metrics written to {path}.")
+
+    prom_path = prom_path or METRICS_PROM_PATH
+    if prom_path:
+        # write then rename so a textfile collector never reads a partial file
+        tmp_path = prom_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(_promLines(summary)) + "\n")
+        os.replace(tmp_path, prom_path)
+    return summary
@@ -0,0 +1,115 @@
+from ETL.columnar import compactFrame
+from ETL.metrics import BatchMetrics, activeBatch, record
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+import pandas as pd
+import atexit
+import logging
+import os
+import threading
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# clean batches in this many worker processes; 0 cleans on the pipeline's
+# transform thread
+TRANSFORM_PROCESSES = int(os.getenv("TRANSFORM_PROCESSES") or 0)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _pack(df):
+    # Arrow IPC in a shared memory block, so the frame crosses the process
+    # boundary as one buffer copy instead of a pickle; frames Arrow cannot
+    # type (mixed object columns in raw batches) fall back to pickling
+    if pa is None:
+        return ("frame", df)
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return ("frame", df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as stream:
+        stream.write_table(table)
+    buf = sink.getvalue()
+    shm = SharedMemory(create=True, size=max(1, buf.size))
+    shm.buf[:buf.size] = memoryview(buf).cast("B")
+    shm.close()
+    return ("arrow", shm.name, buf.size)
+
+
+def _unpack(packed):
+    if packed[0] == "frame":
+        return packed[1]
+    _, name, size = packed
+    shm = SharedMemory(name=name)
+    try:
+        # copied out so the block can go before the frame is used
+        data = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        shm.unlink()
+    return pa.ipc.open_stream(pa.py_buffer(data)).read_all().to_pandas()
+
+
+def _run(func, packed, dtypes):
+    # metrics recorded while cleaning go back with the frame, the worker has
+    # no batch of its own to record them on
+    batch = BatchMetrics(0)
+    with activeBatch(batch):
+        frame = compactFrame(func(_unpack(packed)), dtypes or {})
+    return _pack(frame), {field: value for field, value in batch.values.items() if value}
+
+
+def transformPool(processes=TRANSFORM_PROCESSES):
+    # one pool for the whole run, shared by every stage; forkserver because
+    # the parent is full of threads and open connections
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=processes, mp_context=get_context("forkserver"))
+            atexit.register(_pool.shutdown)
+            logging.info(f"Cleaning batches in {processes} worker processes.")
+        return _pool
+
+
+def _release(future):
+    # unlink the result block of a batch nobody will read
+    if not future.cancelled() and future.exception() is None:
+        packed, _ = future.result()
+        _unpack(packed)
+
+
+class Offloaded:
+    # A batch being cleaned in a worker process; runPipeline keeps several in
+    # flight and hands them to the writers in order.
+    def __init__(self, future, packed):
+        self.future = future
+        self.packed = packed
+
+    def discard(self):
+        if self.future.cancel():
+            # never started, so the input block is still ours to unlink
+            _unpack(self.packed)
+        else:
+            # runs now if already finished, otherwise once the worker is done
+            self.future.add_done_callback(_release)
+
+    def result(self) -> pd.DataFrame:
+        packed, recorded = self.future.result()
+        for field, value in recorded.items():
+            record(field, value)
+        return _unpack(packed)
+
+
+def offload(func, df, dtypes=None, processes=TRANSFORM_PROCESSES):
+    # func(df) then compactFrame, in a worker process when enabled; func must
+    # be a module-level function so the workers can import it
+    if processes <= 0:
+        return compactFrame(func(df), dtypes or {})
+    packed = _pack(df)
+    return Offloaded(transformPool(processes).submit(_run, func, packed, dtypes), packed)
@@ -0,0 +1,229 @@
+from config import supa
+from ETL.metrics import activeBatch, timed
+from ETL.columnar import COLUMNAR, columnarFrame
+from ETL.offload import TRANSFORM_PROCESSES, Offloaded
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from sqlalchemy import select, func
+import pandas as pd
+import logging
+import itertools
+import queue
+import threading
+import os
+import time
+
+PIPELINE_DEPTH = int(os.getenv("PIPELINE_DEPTH") or 2)
+# warehouse connections writing batches concurrently in each pipeline
+PIPELINE_WRITERS = int(os.getenv("PIPELINE_WRITERS") or 1)
+
+_DONE = object()
+
+
+def readPages(session, stmt, key, low, high, batch_size, dtypes=None):
+    # keyset pagination over key in (low, high]: every page is its own short
+    # query bounded by primary key values, so a run can pick up again after
+    # the last committed page instead of replaying one long server-side cursor.
+    # batch_size counts keys and is either a number or a callable returning one;
+    # each frame carries its key count in attrs["keys"] for the batch sizer.
+    columnar = COLUMNAR and dtypes is not None
+    while low < high:
+        size = batch_size() if callable(batch_size) else batch_size
+        page = select(key).where(key > low, key <= high).order_by(key).limit(size).subquery()
+        end, count = session.execute(select(func.max(page.c[0]), func.count()).select_from(page)).one()
+        end = high if count < size else end
+
+        result = session.execute(stmt.where(key > low, key <= end).order_by(key))
+        keys = list(result.keys())
+        rows = result.fetchall()
+        low = end
+        if not rows:
+            continue
+        frame = columnarFrame(rows, keys, dtypes) if columnar else pd.DataFrame(rows, columns=keys)
+        frame.attrs["keys"] = count
+        yield frame
+
+
+class CommitFrontier:
+    # Concurrent writers commit batches out of order; a checkpoint may only
+    # move past a batch once it and every batch before it have committed.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next = 0
+        self._committed = set()
+        self._positions = {}
+
+    def advance(self, seq, position):
+        # checkpoint to commit along with batch seq, or None while an earlier
+        # batch is still in flight
+        with self._lock:
+            self._positions[seq] = position
+            if seq != self._next:
+                return None
+            while seq + 1 in self._committed:
+                seq += 1
+            return self._positions[seq]
+
+    def committed(self, seq):
+        with self._lock:
+            self._committed.add(seq)
+            while self._next in self._committed:
+                self._committed.discard(self._next)
+                self._positions.pop(self._next, None)
+                self._next += 1
+
+
+def writerCount(pipelines, writers=PIPELINE_WRITERS):
+    # every concurrent pipeline holds its writers' connections from the one
+    # warehouse pool; past pool_size + max_overflow they would wait on it
+    budget = supa.POOL_SIZE + supa.MAX_OVERFLOW
+    return max(1, min(writers, budget // max(1, pipelines)))
+
+
+@contextmanager
+def writerConnections(conn, count=PIPELINE_WRITERS):
+    # the stage's own connection plus count - 1 more from the same engine
+    with ExitStack() as stack:
+        yield [conn] + [stack.enter_context(conn.engine.connect()) for _ in range(count - 1)]
+
+
+def runPipeline(reader, transform, writer, connections, depth=PIPELINE_DEPTH, metrics=None, sizer=None, checkpoint=None):
+    # reader -> transform -> writers, each in its own thread and connected by
+    # bounded queues so the source fetch overlaps the warehouse round-trips.
+    # transform returns (frame, position), where frame may be an Offloaded
+    # batch still being cleaned in a worker process; writer(conn, frame) issues the
+    # upserts and returns the rows it wrote, then the pipeline records the
+    # checkpoint and commits. Every connection gets its own writer, the first
+    # one on the calling thread. Returns the total rows written.
+    stop = threading.Event()
+    errors = []
+    written = []
+    raw = queue.Queue(maxsize=depth)
+    cleaned = queue.Queue(maxsize=max(depth, len(connections)))
+    frontier = CommitFrontier()
+
+    def fail(e):
+        errors.append(e)
+        stop.set()
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if stop.is_set():
+                    return _DONE
+
+    def readStage():
+        try:
+            batches = iter(reader)
+            for seq in itertools.count():
+                started = time.perf_counter()
+                batch = next(batches, _DONE)
+                if batch is _DONE:
+                    return
+                batch_metrics = None
+                if metrics is not None:
+                    rows_in = len(batch) if hasattr(batch, "__len__") else 0
+                    batch_metrics = metrics.newBatch(
+                        fetch_s=time.perf_counter() - started,
+                        rows_in=rows_in,
+                        keys_in=getattr(batch, "attrs", {}).get("keys", rows_in),
+                    )
+                if not put(raw, (seq, batch_metrics, batch)):
+                    return
+        except BaseException as e:
+            fail(e)
+        finally:
+            put(raw, _DONE)
+
+    def transformStage():
+        # offloaded batches stay in flight up to one per worker process and
+        # leave in sequence order
+        pending = deque()
+
+        def flush(limit):
+            while len(pending) > limit:
+                seq, batch_metrics, (frame, position) = pending.popleft()
+                if isinstance(frame, Offloaded):
+                    with activeBatch(batch_metrics), timed("transform_s"):
+                        frame = frame.result()
+                if not put(cleaned, (seq, batch_metrics, (frame, position))):
+                    return False
+            return True
+
+        try:
+            while (item := get(raw)) is not _DONE:
+                seq, batch_metrics, batch = item
+                with activeBatch(batch_metrics), timed("transform_s"):
+                    pending.append((seq, batch_metrics, transform(batch)))
+                if not flush(max(0, TRANSFORM_PROCESSES - 1)):
+                    return
+            if not stop.is_set():
+                flush(0)
+        except BaseException as e:
+            fail(e)
+        finally:
+            # a stopped pipeline leaves offloaded batches nobody will write
+            for _, _, (frame, _) in pending:
+                if isinstance(frame, Offloaded):
+                    frame.discard()
+            pending.clear()
+            put(cleaned, _DONE)
+
+    def writeStage(conn):
+        total = 0
+        try:
+            while (item := get(cleaned)) is not _DONE:
+                seq, batch_metrics, (frame, position) = item
+                with activeBatch(batch_metrics):
+                    total += writer(conn, frame) or 0
+                    target = frontier.advance(seq, position)
+                    if checkpoint is not None and target is not None:
+                        checkpoint(conn, target)
+                    with timed("commit_s"):
+                        conn.commit()
+                frontier.committed(seq)
+                if batch_metrics is not None:
+                    batch_metrics.finish()
+                    if sizer is not None:
+                        sizer.observeBatch(batch_metrics)
+            # let the other writers see the end of the stream too
+            put(cleaned, _DONE)
+        except BaseException as e:
+            fail(e)
+        finally:
+            written.append(total)
+
+    threads = [
+        threading.Thread(target=readStage, name="pipeline-read", daemon=True),
+        threading.Thread(target=transformStage, name="pipeline-transform", daemon=True),
+    ] + [
+        threading.Thread(target=writeStage, args=(conn,), name=f"pipeline-write-{i}", daemon=True)
+        for i, conn in enumerate(connections[1:], start=1)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        writeStage(connections[0])
+        for thread in threads[2:]:
+            thread.join()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        logging.error(f"Pipeline stopped: {errors[0]}")
+        raise errors[0]
+    return sum(written)
@@ -1,11 +1,22 @@
 from config import local, supa
+from ETL.loader import copyUpsert
+from ETL.schema import reflectTables
+from ETL.state import (
+    ensureStateTables, getWatermark, setWatermark, saveKeyMap, highWater,
+    planRanges, setCheckpoint, clearCheckpoints,
+)
+from ETL.keymap import refreshKeyMap
+from ETL.pipeline import readPages, runPipeline, writerConnections, writerCount
+from ETL.scheduler import maxWorkers
+from ETL.metrics import startStage, record
+from ETL.batching import BatchSizer
+from ETL.offload import offload
+from ETL.cleaning import Cleaner
 from contextlib import contextmanager
-from sqlalchemy import select, MetaData, text
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import select, func, text
 import pandas as pd
 import numpy as np
 import logging
-import itertools
 import gc
 import os
 import time
@@ -16,6 +27,23 @@ logging.basicConfig(
 
 BATCH_SIZE = int(os.getenv("BATCH_SIZE") or 5000)
 
+# compact dtypes for the COLUMNAR=1 extraction path
+SOURCE_DTYPES = {
+    "nat_key": "int32",
+    "category": "category",
+    "description": "string",
+    "name": "string",
+}
+
+# rules run on each column's distinct values only, memoized across batches
+CLEANER = Cleaner({
+    "category": lambda s: s.str.strip().str.lower().replace(
+       {'toy':'Toys', 'toys':'Toys', 'appliances':'Appliances',
+        'gadgets':'Gadgets', 'electronics':'Electronics', 'laptops':'Laptops', 
+        'makeup': 'Make Up', 'make up': 'Make Up',
+        'bag':'Bags', 'bags':'Bags', 'clothes':'Clothes', 'men\'s apparel':'Men\'s Apparel'}),
+})
+
 
 @contextmanager
 def extract():
@@ -46,31 +74,20 @@ def warehouse_conn():
 
 def cleanProductData(df: pd.DataFrame) -> pd.DataFrame:
     df = df.dropna(subset=["category", "description", "name", "price"]).copy()
-    df["category"] = df["category"].str.strip().str.lower()
     df["description"] = df["description"].str.strip().str.title()
     df["name"] = df["name"].str.strip().str.title()
+    df = CLEANER.apply(df)
     
     df['price'] = np.ceil(df['price'] * 100)/100
-    
-    df['category'] = df['category'].replace(
-       {'toy':'Toys', 'toys':'Toys', 'appliances':'Appliances',
-        'gadgets':'Gadgets', 'electronics':'Electronics', 'laptops':'Laptops', 
-        'makeup': 'Make Up', 'make up': 'Make Up',
-        'bag':'Bags', 'bags':'Bags', 'clothes':'Clothes', 'men\'s apparel':'Men\'s Apparel'})
 
     df = df.drop_duplicates(subset=["category","name","description"]).reset_index(drop=True)
     return df[["nat_key", "category", "description", "name", "price"]]
 
 
-def extractProduct():
+def extractProduct(full_refresh=False, resume=True):
     start = time.time()
-    metadata = MetaData()
-    metadata.reflect(bind=local.engine, only=["products"])
-    prods = metadata.tables["products"]
-    
-    target_metadata = MetaData()
-    target_metadata.reflect(bind=supa.engine, only=["Products"])
-    target_prods = target_metadata.tables["Products"]
+    prods = reflectTables(local.engine, ["products"])["products"]
+    target_prods = reflectTables(supa.engine, ["Products"])["Products"]
 
     stmt = (
         select(
@@ -80,45 +97,49 @@ def extractProduct():
             prods.c.name,
             prods.c.price,
         )
-        .execution_options(stream_results=True, yield_per=BATCH_SIZE)
     )
 
     total_inserted = 0
     logging.info("Starting product data extraction.")
+    stage_metrics = startStage("product")
+    sizer = BatchSizer("product")
 
     mapping_data = []
 
     with extract() as session, warehouse_conn() as conn:
-        result = session.execute(stmt)
-
-        while True:
-            chunk = list(itertools.islice(result, BATCH_SIZE))
-            if not chunk:
-                break
-
-            df = pd.DataFrame(chunk, columns=result.keys())
+        ensureStateTables(conn)
+        watermark = None if full_refresh else getWatermark(conn, "product")
+        low, high = session.execute(select(func.min(prods.c.id) - 1, func.max(prods.c.id))).one()
+        if watermark is not None:
+            low = watermark
+        ranges = [(low, high)] if high is not None and low < high else []
+        ranges, high_water, resumed = planRanges(conn, "product", ranges, resume)
+        conn.commit()
+        if resumed:
+            logging.info(f"Resuming product extraction from checkpoint {ranges}.")
+        elif watermark is not None:
+            logging.info(f"Incremental product extraction from id > {watermark}.")
+        if high_water is None:
+            high_water = watermark
+
+        def transform(df):
             logging.info(f"Extracted {len(df)} raw product records.")
-            
-            df = cleanProductData(df)
-            
+            return offload(cleanProductData, df, SOURCE_DTYPES), highWater(None, df["nat_key"])
+
+        def load(conn, df):
             if df.empty:
-                continue
-
-            insert_data = df[["category", "description", "name", "price"]].to_dict(orient="records")
-            insert_stmt = insert(target_prods).values(insert_data)
-            upsert_stmt = insert_stmt.on_conflict_do_update(
-                index_elements=["name","description"],
-                set_={
-                    "category": insert_stmt.excluded.category,
-                    "price": insert_stmt.excluded.price,
-                },
-            ).returning(target_prods.c.id, target_prods.c.name, target_prods.c.description)
-
-            result_set = conn.execute(upsert_stmt)
-            conn.commit()
-            db_rows = result_set.fetchall()
-            total_inserted += len(db_rows)
-            
+                return 0
+
+            db_rows = copyUpsert(
+                conn,
+                target_prods,
+                df[["category", "description", "name", "price"]],
+                index_elements=["name", "description"],
+                update_columns=["category", "price"],
+                returning=["id", "name", "description"],
+            )
+            record("rows_out", len(df))
+
             if db_rows:
                 surrogate_key_df = pd.DataFrame(db_rows, columns=['id', 'name', 'description'])
                 surrogate_key_df = surrogate_key_df.rename(columns={'id': 'surrogate_key'})
@@ -126,12 +147,33 @@ def extractProduct():
                 merged_df = pd.merge(df, surrogate_key_df, on=['name', 'description'], how='inner')
 
                 if not merged_df.empty:
+                    saveKeyMap(conn, "product", merged_df)
                     mapping_data.append(merged_df[['nat_key', 'surrogate_key']])
-            
-            del df, chunk, db_rows, merged_df, surrogate_key_df
-            gc.collect()
 
-    mapped_df = pd.concat(mapping_data, ignore_index=True) if mapping_data else pd.DataFrame(columns=['nat_key', 'surrogate_key'])
+            gc.collect()
+            return len(db_rows)
+
+        def checkpoint(conn, position):
+            setCheckpoint(conn, "product", high_water, position)
+
+        # dimension stages may all be running at once
+        with writerConnections(conn, writerCount(maxWorkers())) as connections:
+            for range_low, range_high in ranges:
+                reader = readPages(session, stmt, prods.c.id, range_low, range_high, sizer.current, SOURCE_DTYPES)
+                total_inserted += runPipeline(
+                    reader, transform, load, connections,
+                    metrics=stage_metrics, sizer=sizer, checkpoint=checkpoint,
+                )
+
+        clearCheckpoints(conn, "product")
+        if high_water != watermark:
+            setWatermark(conn, "product", high_water)
+        conn.commit()
+
+        delta_df = pd.concat(mapping_data, ignore_index=True) if mapping_data else pd.DataFrame(columns=['nat_key', 'surrogate_key'])
+        mapped_df = refreshKeyMap(conn, "product", watermark, high_water, delta_df, resumed)
+        stage_metrics.set("batch_size", sizer.summary())
+        stage_metrics.finish()
     logging.info(f"ETL completed - {total_inserted} products, {len(mapped_df)} mappings")
     end = time.time()
     length = end - start
@@ -0,0 +1,182 @@
+from ETL.schema import reflectTables
+from sqlalchemy import (
+    MetaData, Table, Column, String, Integer, BigInteger, Float, Date,
+    and_, or_, inspect, literal, select, delete, func, text, tuple_,
+)
+from sqlalchemy.dialects.postgresql import insert
+import logging
+import os
+import threading
+
+# keep the dashboard summary tables in step with every fact batch
+ROLLUPS = (os.getenv("ROLLUPS") or "1") != "0"
+
+MEASURES = ["revenue", "quantity", "orderCount"]
+DELTA_NAME = "_rollup_delta"
+
+rollup_metadata = MetaData()
+
+
+def _measures():
+    return [
+        Column("revenue", Float, nullable=False),
+        Column("quantity", BigInteger, nullable=False),
+        Column("orderCount", BigInteger, nullable=False),
+    ]
+
+
+rollup_daily = Table(
+    "RollupDaily",
+    rollup_metadata,
+    Column("DateId", Integer, primary_key=True),
+    *_measures(),
+)
+
+rollup_category = Table(
+    "RollupCategory",
+    rollup_metadata,
+    Column("category", String(255), primary_key=True),
+    *_measures(),
+)
+
+rollup_location = Table(
+    "RollupLocation",
+    rollup_metadata,
+    Column("country", String(255), primary_key=True),
+    Column("city", String(255), primary_key=True),
+    *_measures(),
+)
+
+rollup_month_category = Table(
+    "RollupMonthCategory",
+    rollup_metadata,
+    Column("month", Date, primary_key=True),
+    Column("category", String(255), primary_key=True),
+    *_measures(),
+)
+
+# signed per-fact changes of one batch: old rows subtracted, new rows added
+_delta = Table(
+    DELTA_NAME,
+    MetaData(),
+    Column("DateId", Integer),
+    Column("ProductId", Integer),
+    Column("LocationId", Integer),
+    Column("revenue", Float),
+    Column("quantity", BigInteger),
+    Column("orderCount", BigInteger),
+)
+
+_ensure_lock = threading.Lock()
+_ensured = False
+
+
+def ensureRollupTables(conn):
+    # True when the tables were just created and still need a rebuild
+    global _ensured
+    with _ensure_lock:
+        if _ensured:
+            return False
+        existing = set(inspect(conn).get_table_names())
+        created = any(t.name not in existing for t in rollup_metadata.sorted_tables)
+        rollup_metadata.create_all(bind=conn, checkfirst=True)
+        conn.commit()
+        _ensured = True
+        return created
+
+
+def _createDelta(conn):
+    quote = conn.dialect.identifier_preparer.quote
+    conn.execute(text(
+        f"CREATE TEMP TABLE IF NOT EXISTS {quote(DELTA_NAME)} ("
+        '"DateId" integer, "ProductId" integer, "LocationId" integer, '
+        'revenue double precision, quantity bigint, "orderCount" bigint'
+        ") ON COMMIT DROP"
+    ))
+
+
+def _collect(conn, facts, sign, matched=None):
+    rows = select(
+        facts.c.DateId,
+        facts.c.ProductId,
+        facts.c.LocationId,
+        (facts.c.revenue * sign).label("revenue"),
+        (facts.c.quantity * sign).label("quantity"),
+        literal(sign, BigInteger).label("orderCount"),
+    )
+    if matched is not None:
+        rows = rows.select_from(facts.join(*matched))
+    conn.execute(insert(_delta).from_select(
+        ["DateId", "ProductId", "LocationId", "revenue", "quantity", "orderCount"], rows
+    ))
+
+
+def _apply(conn, dims):
+    date, products, location = dims["Date"], dims["Products"], dims["Location"]
+    month = func.cast(func.date_trunc("month", date.c.date), Date).label("month")
+    specs = [
+        (rollup_daily, [_delta.c.DateId], _delta),
+        (rollup_category, [products.c.category], _delta.join(products, products.c.id == _delta.c.ProductId)),
+        (rollup_location, [location.c.country, location.c.city], _delta.join(location, location.c.id == _delta.c.LocationId)),
+        (
+            rollup_month_category,
+            [month, products.c.category],
+            _delta.join(date, date.c.id == _delta.c.DateId).join(products, products.c.id == _delta.c.ProductId),
+        ),
+    ]
+    for target, keys, source in specs:
+        key_names = [c.name for c in target.primary_key.columns]
+        # grouped and ordered by key so concurrent writers lock rollup rows in
+        # the same order; groups whose delta nets to zero (re-sent, unchanged
+        # facts) are left alone rather than rewritten
+        rows = (
+            select(*keys, *[func.sum(_delta.c[m]) for m in MEASURES])
+            .select_from(source)
+            .group_by(*keys)
+            .having(or_(*[func.sum(_delta.c[m]) != 0 for m in MEASURES]))
+            .order_by(*keys)
+        )
+        stmt = insert(target).from_select(key_names + MEASURES, rows)
+        touched = conn.execute(stmt.on_conflict_do_update(
+            index_elements=key_names,
+            set_={m: target.c[m] + stmt.excluded[m] for m in MEASURES},
+        ).returning(*[target.c[k] for k in key_names], target.c.orderCount)).fetchall()
+        # groups whose last fact moved elsewhere; only this batch's groups can
+        # have dropped to zero, and they are deleted by primary key
+        emptied = [tuple(row[:-1]) for row in touched if row[-1] == 0]
+        if emptied:
+            keys = [target.c[k] for k in key_names]
+            conn.execute(delete(target).where(tuple_(*keys).in_(emptied)))
+    conn.execute(delete(_delta))
+
+
+def rollupHooks(index_elements):
+    # (before, after) hooks for copyUpsert on FactSales: the fact rows a batch
+    # is about to overwrite are subtracted, the rows it left behind are added
+    def matching(conn, staging):
+        tables = reflectTables(conn.engine, ["FactSales", "Date", "Products", "Location"])
+        facts = tables["FactSales"]
+        return tables, (staging, and_(*[facts.c[c] == staging.c[c] for c in index_elements]))
+
+    def before(conn, staging):
+        tables, matched = matching(conn, staging)
+        _createDelta(conn)
+        _collect(conn, tables["FactSales"], -1, matched)
+
+    def after(conn, staging):
+        tables, matched = matching(conn, staging)
+        _collect(conn, tables["FactSales"], 1, matched)
+        _apply(conn, tables)
+
+    return before, after
+
+
+def rebuildRollups(conn):
+    tables = reflectTables(conn.engine, ["FactSales", "Date", "Products", "Location"])
+    for target in rollup_metadata.sorted_tables:
+        conn.execute(delete(target))
+    _createDelta(conn)
+    _collect(conn, tables["FactSales"], 1)
+    _apply(conn, tables)
+    conn.commit()
+    logging.info("Rollup tables rebuilt from FactSales.")
@@ -0,0 +1,99 @@
+from config import local, supa
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import logging
+import time
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+
+class Stage:
+    def __init__(self, name, fn, deps=()):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+
+
+def maxWorkers():
+    # every running stage holds one source session and one warehouse connection,
+    # so never run more stages than either pool can serve without overflowing
+    return max(1, min(local.POOL_SIZE, supa.POOL_SIZE))
+
+
+def orderStages(stages):
+    by_name = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError(f"Duplicate stage '{stage.name}'")
+        by_name[stage.name] = stage
+
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+
+    ordered = []
+    state = {}
+
+    def visit(stage):
+        if state.get(stage.name) == "done":
+            return
+        if state.get(stage.name) == "visiting":
+            raise ValueError(f"Dependency cycle through stage '{stage.name}'")
+        state[stage.name] = "visiting"
+        for dep in stage.deps:
+            visit(by_name[dep])
+        state[stage.name] = "done"
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return ordered
+
+
+def runStages(stages, max_workers=None):
+    pending = orderStages(stages)
+    max_workers = max_workers or maxWorkers()
+    results = {}
+    timings = {}
+    running = {}
+    error = None
+
+    logging.info(f"Running {len(pending)} stages with up to {max_workers} workers.")
+
+    def runOne(stage):
+        start = time.time()
+        result = stage.fn(*[results[dep] for dep in stage.deps])
+        return result, time.time() - start
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage") as pool:
+        while pending or running:
+            if error is None:
+                ready = [s for s in pending if all(dep in results for dep in s.deps)]
+                for stage in ready[:max_workers - len(running)]:
+                    pending.remove(stage)
+                    logging.info(f"Stage '{stage.name}' started.")
+                    running[pool.submit(runOne, stage)] = stage
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    results[stage.name], timings[stage.name] = future.result()
+                    logging.info(f"Stage '{stage.name}' finished in {timings[stage.name]:.2f} seconds.")
+                except Exception as e:
+                    logging.error(f"Stage '{stage.name}' failed: {e}")
+                    if error is None:
+                        error = e
+
+    if error is not None:
+        skipped = [s.name for s in pending]
+        if skipped:
+            logging.error(f"Skipped stages after failure: {', '.join(skipped)}")
+        raise error
+
+    return results, timings
@@ -0,0 +1,115 @@
+from sqlalchemy import MetaData, PrimaryKeyConstraint, UniqueConstraint, text, bindparam
+import logging
+import hashlib
+import os
+import pickle
+import threading
+
+SCHEMA_CACHE_DIR = os.getenv("SCHEMA_CACHE_DIR") or ".schema_cache"
+
+_memo = {}
+_locks = {}
+_lock = threading.Lock()
+
+# One cheap round-trip that changes whenever a column or index of the tables does
+_VERSION_SQL = {
+    "postgresql": text(
+        """
+        SELECT
+            (SELECT md5(string_agg(
+                        table_name || '.' || column_name || ':' || data_type || ':' || is_nullable,
+                        ',' ORDER BY table_name, ordinal_position))
+               FROM information_schema.columns
+              WHERE table_schema = current_schema() AND table_name IN :names)
+            || ':' ||
+            coalesce((SELECT md5(string_agg(indexdef, ',' ORDER BY indexname))
+                        FROM pg_indexes
+                       WHERE schemaname = current_schema() AND tablename IN :names), '')
+        """
+    ).bindparams(bindparam("names", expanding=True)),
+    "mysql": text(
+        """
+        SELECT CONCAT(COUNT(*), ':', COALESCE(SUM(CRC32(CONCAT_WS(':',
+                   table_name, column_name, column_type, is_nullable, column_key))), 0))
+          FROM information_schema.columns
+         WHERE table_schema = DATABASE() AND table_name IN :names
+        """
+    ).bindparams(bindparam("names", expanding=True)),
+}
+
+
+def _cachePath(engine, names):
+    key = f"{engine.url.render_as_string(hide_password=True)}|{','.join(names)}"
+    return os.path.join(SCHEMA_CACHE_DIR, hashlib.sha1(key.encode()).hexdigest() + ".pkl")
+
+
+def schemaVersion(conn, names):
+    sql = _VERSION_SQL.get(conn.dialect.name)
+    if sql is None:
+        return None
+    return conn.execute(sql, {"names": list(names)}).scalar()
+
+
+def _loadSnapshot(path, version):
+    if version is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            cached_version, metadata = pickle.load(f)
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable schema cache {path}: {e}")
+        return None
+    return metadata if cached_version == version else None
+
+
+def _saveSnapshot(path, version, metadata):
+    if version is None:
+        return
+    os.makedirs(SCHEMA_CACHE_DIR, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump((version, metadata), f)
+    os.replace(tmp_path, path)
+
+
+def reflectTables(engine, names):
+    names = tuple(sorted(names))
+    key = (str(engine.url), names)
+
+    with _lock:
+        key_lock = _locks.setdefault(key, threading.Lock())
+
+    with key_lock:
+        metadata = _memo.get(key)
+        if metadata is None:
+            path = _cachePath(engine, names)
+            with engine.connect() as conn:
+                version = schemaVersion(conn, names)
+                metadata = _loadSnapshot(path, version)
+                if metadata is None:
+                    logging.info(f"Reflecting {', '.join(names)} from {engine.url.host}.")
+                    metadata = MetaData()
+                    metadata.reflect(bind=conn, only=list(names))
+                    _saveSnapshot(path, version, metadata)
+            _memo[key] = metadata
+
+    return {name: metadata.tables[name] for name in names}
+
+
+def uniqueKeys(table):
+    keys = [
+        [c.name for c in constraint.columns]
+        for constraint in table.constraints
+        if isinstance(constraint, (UniqueConstraint, PrimaryKeyConstraint))
+    ]
+    keys += [[c.name for c in index.columns] for index in table.indexes if index.unique]
+    return keys
+
+
+def conflictKey(table, column):
+    # the narrowest unique key containing column, e.g. (OrderNumber) on a plain
+    # FactSales but (OrderNumber, DateId) once it is partitioned by DateId
+    candidates = [key for key in uniqueKeys(table) if column in key]
+    if not candidates:
+        raise ValueError(f"{table.name} has no unique key on {column}")
+    return min(candidates, key=len)
@@ -0,0 +1,171 @@
+from ETL.loader import copyUpsert
+from sqlalchemy import MetaData, Table, Column, String, BigInteger, DateTime, and_, select, update, delete, func
+from sqlalchemy.dialects.postgresql import insert
+import pandas as pd
+import threading
+import time
+
+state_metadata = MetaData()
+
+etl_state = Table(
+    "ETLState",
+    state_metadata,
+    Column("stage", String(64), primary_key=True),
+    Column("watermark", BigInteger),
+    Column("updatedAt", DateTime(timezone=True), server_default=func.now()),
+)
+
+# nat_key -> surrogate_key pairs of every dimension stage, so incremental runs
+# can still resolve facts against rows loaded by earlier runs
+etl_keymap = Table(
+    "ETLKeyMap",
+    state_metadata,
+    Column("stage", String(64), primary_key=True),
+    Column("nat_key", BigInteger, primary_key=True),
+    Column("surrogate_key", BigInteger, nullable=False),
+)
+
+# progress of an unfinished run: one row per (stage, key range), with the last
+# source key whose batch was committed. Rows are removed once the stage finishes.
+etl_checkpoint = Table(
+    "ETLCheckpoint",
+    state_metadata,
+    Column("stage", String(64), primary_key=True),
+    Column("range_end", BigInteger, primary_key=True),
+    Column("range_start", BigInteger, nullable=False),
+    Column("position", BigInteger, nullable=False),
+    Column("updatedAt", DateTime(timezone=True), server_default=func.now()),
+)
+
+_ensure_lock = threading.Lock()
+_ensured = False
+
+
+def ensureStateTables(conn):
+    global _ensured
+    with _ensure_lock:
+        if not _ensured:
+            state_metadata.create_all(bind=conn, checkfirst=True)
+            conn.commit()
+            _ensured = True
+
+
+def getWatermark(conn, stage):
+    return conn.execute(
+        select(etl_state.c.watermark).where(etl_state.c.stage == stage)
+    ).scalar_one_or_none()
+
+
+def setWatermark(conn, stage, watermark):
+    insert_stmt = insert(etl_state).values(stage=stage, watermark=int(watermark), updatedAt=func.now())
+    conn.execute(insert_stmt.on_conflict_do_update(
+        index_elements=["stage"],
+        set_={
+            "watermark": insert_stmt.excluded.watermark,
+            "updatedAt": insert_stmt.excluded.updatedAt,
+        },
+    ))
+
+
+# ETLState row whose watermark stamps the last finished load; query caches
+# compare against it to drop results computed before that load
+RUN_VERSION_STAGE = "run"
+
+
+def getRunVersion(conn):
+    return getWatermark(conn, RUN_VERSION_STAGE)
+
+
+def setRunVersion(conn, version=None):
+    setWatermark(conn, RUN_VERSION_STAGE, version if version is not None else time.time_ns() // 1000)
+
+
+def getCheckpoints(conn, stage):
+    rows = conn.execute(
+        select(etl_checkpoint.c.range_start, etl_checkpoint.c.range_end, etl_checkpoint.c.position)
+        .where(etl_checkpoint.c.stage == stage)
+        .order_by(etl_checkpoint.c.range_end)
+    ).fetchall()
+    return [tuple(row) for row in rows]
+
+
+def startCheckpoints(conn, stage, ranges):
+    clearCheckpoints(conn, stage)
+    if ranges:
+        conn.execute(insert(etl_checkpoint), [
+            {"stage": stage, "range_start": int(low), "range_end": int(high), "position": int(low)}
+            for low, high in ranges
+        ])
+
+
+def setCheckpoint(conn, stage, range_end, position):
+    # runs inside the batch's transaction so the checkpoint commits with the data
+    conn.execute(
+        update(etl_checkpoint)
+        .where(etl_checkpoint.c.stage == stage, etl_checkpoint.c.range_end == int(range_end))
+        .values(position=int(position), updatedAt=func.now())
+    )
+
+
+def clearCheckpoints(conn, stage):
+    conn.execute(delete(etl_checkpoint).where(etl_checkpoint.c.stage == stage))
+
+
+def planRanges(conn, stage, ranges, resume=True):
+    # pick up an interrupted run where its checkpoints left off, otherwise
+    # record the fresh ranges. Returns (pending ranges, high water, resumed).
+    checkpoints = getCheckpoints(conn, stage) if resume else []
+    if checkpoints:
+        pending = [(position, high) for _, high, position in checkpoints if position < high]
+        return pending, max(high for _, high, _ in checkpoints), True
+    startCheckpoints(conn, stage, ranges)
+    return ranges, max((high for _, high in ranges), default=None), False
+
+
+def saveKeyMap(conn, stage, mapping: pd.DataFrame):
+    if mapping.empty:
+        return
+    df = mapping[["nat_key", "surrogate_key"]].assign(stage=stage)[["stage", "nat_key", "surrogate_key"]]
+    copyUpsert(
+        conn,
+        etl_keymap,
+        df,
+        index_elements=["stage", "nat_key"],
+        update_columns=["surrogate_key"],
+    )
+
+
+def loadKeyMap(conn, stage) -> pd.DataFrame:
+    result = conn.execute(
+        select(etl_keymap.c.nat_key, etl_keymap.c.surrogate_key).where(etl_keymap.c.stage == stage)
+    )
+    return pd.DataFrame(result.fetchall(), columns=["nat_key", "surrogate_key"])
+
+
+def keyMapJoin(staging, columns, key_stages):
+    # staging rows with the natural keys in key_stages swapped for surrogate
+    # keys from ETLKeyMap; rows without a mapping drop out of the inner joins
+    selected = []
+    joined = staging
+    for col in columns:
+        if col not in key_stages:
+            selected.append(staging.c[col])
+            continue
+        key_map = etl_keymap.alias(f"km_{col.lower()}")
+        joined = joined.join(key_map, and_(
+            key_map.c.stage == key_stages[col],
+            key_map.c.nat_key == staging.c[col],
+        ))
+        selected.append(key_map.c.surrogate_key.label(col))
+    return select(*selected).select_from(joined)
+
+
+def highWater(current, keys):
+    if isinstance(keys, pd.Series):
+        if keys.empty:
+            return current
+        keys = keys.max()
+    if keys is None:
+        return current
+    top = int(keys)
+    return top if current is None else max(current, top)
@@ -1,10 +1,22 @@
 from config import local, supa
+from ETL.loader import copyUpsert
+from ETL.schema import reflectTables
+from ETL.state import (
+    ensureStateTables, getWatermark, setWatermark, saveKeyMap, highWater,
+    planRanges, setCheckpoint, clearCheckpoints,
+)
+from ETL.keymap import refreshKeyMap
+from ETL.pipeline import readPages, runPipeline, writerConnections, writerCount
+from ETL.scheduler import maxWorkers
+from ETL.metrics import startStage, record
+from ETL.batching import BatchSizer
+from ETL.offload import TRANSFORM_PROCESSES, offload
+from ETL.cleaning import Cleaner
+from ETL.dates import DateParser
 from contextlib import contextmanager
-from sqlalchemy import select, MetaData, text
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import select, func, text
 import pandas as pd
 import logging
-import itertools
 import gc
 import os
 import time
@@ -15,6 +27,27 @@ logging.basicConfig(
 
 BATCH_SIZE = int(os.getenv("BATCH_SIZE") or 5000)
 
+# compact dtypes for the COLUMNAR=1 extraction path
+SOURCE_DTYPES = {
+    "nat_key": "int32",
+    "username": "string",
+    "firstName": "string",
+    "lastName": "string",
+    "gender": "category",
+}
+
+BIRTH_DATES = DateParser("dateOfBirth")
+
+# rules run on each column's distinct values only, memoized across batches;
+# only for low-cardinality columns, mostly-unique ones are cheaper vectorized
+CLEANER = Cleaner({
+    "gender": lambda s: (
+        s.str.strip()
+        .str.lower()
+        .replace({"male": "M", "female": "F", "m": "M", "f": "F"})
+    ),
+})
+
 
 @contextmanager
 def extract():
@@ -47,26 +80,19 @@ def cleanUserData(df: pd.DataFrame) -> pd.DataFrame:
     df["username"] = df["username"].str.strip().str.lower()
     df["firstName"] = df["firstName"].str.strip().str.title()
     df["lastName"] = df["lastName"].str.strip().str.title()
-    df["gender"] = (
-        df["gender"]
-        .str.strip()
-        .str.lower()
-        .replace({"male": "M", "female": "F", "m": "M", "f": "F"})
-    )
-    df['dateOfBirth'] = pd.to_datetime(df['dateOfBirth'], format='mixed')
+    df = CLEANER.apply(df)
+    df['dateOfBirth'] = BIRTH_DATES.parse(df['dateOfBirth'])
+    # "dateOfBirth" is NOT NULL in the warehouse; users without a readable
+    # one are dropped here and show up in the batch's rows_dropped
+    df = df.dropna(subset=["dateOfBirth"])
     
     df = df.drop_duplicates(subset=["username"]).reset_index(drop=True)
     return df[["nat_key", "username", "firstName", "lastName", "dateOfBirth", "gender"]]
 
-def extractUser():
+def extractUser(full_refresh=False, resume=True):
     start = time.time()
-    metadata = MetaData()
-    metadata.reflect(bind=local.engine, only=["users"])
-    users = metadata.tables["users"]
-    
-    target_metadata = MetaData()
-    target_metadata.reflect(bind=supa.engine, only=["Users"])
-    target_users = target_metadata.tables["Users"]
+    users = reflectTables(local.engine, ["users"])["users"]
+    target_users = reflectTables(supa.engine, ["Users"])["Users"]
 
     stmt = (
         select(
@@ -77,47 +103,49 @@ def extractUser():
             users.c.dateOfBirth,
             users.c.gender,
         )
-        .execution_options(stream_results=True, yield_per=BATCH_SIZE)
     )
 
     total_inserted = 0
     logging.info("Starting user data extraction.")
+    stage_metrics = startStage("user")
+    sizer = BatchSizer("user")
 
     mapping_data = []
 
     with extract() as session, warehouse_conn() as conn:
-        result = session.execute(stmt)
-
-        while True:
-            chunk = list(itertools.islice(result, BATCH_SIZE))
-            if not chunk:
-                break
-
-            df = pd.DataFrame(chunk, columns=result.keys())
+        ensureStateTables(conn)
+        watermark = None if full_refresh else getWatermark(conn, "user")
+        low, high = session.execute(select(func.min(users.c.id) - 1, func.max(users.c.id))).one()
+        if watermark is not None:
+            low = watermark
+        ranges = [(low, high)] if high is not None and low < high else []
+        ranges, high_water, resumed = planRanges(conn, "user", ranges, resume)
+        conn.commit()
+        if resumed:
+            logging.info(f"Resuming user extraction from checkpoint {ranges}.")
+        elif watermark is not None:
+            logging.info(f"Incremental user extraction from id > {watermark}.")
+        if high_water is None:
+            high_water = watermark
+
+        def transform(df):
             logging.info(f"Extracted {len(df)} raw user records.")
-            
-            df = cleanUserData(df)
-            
+            return offload(cleanUserData, df, SOURCE_DTYPES), highWater(None, df["nat_key"])
+
+        def load(conn, df):
             if df.empty:
-                continue
+                return 0
 
-            insert_data = df[["username", "firstName", "lastName", "dateOfBirth", "gender"]].to_dict(orient="records")
-            insert_stmt = insert(target_users).values(insert_data)
-            upsert_stmt = insert_stmt.on_conflict_do_update(
+            db_rows = copyUpsert(
+                conn,
+                target_users,
+                df[["username", "firstName", "lastName", "dateOfBirth", "gender"]],
                 index_elements=["username"],
-                set_={
-                    "firstName": insert_stmt.excluded.firstName,
-                    "lastName": insert_stmt.excluded.lastName, 
-                    "dateOfBirth": insert_stmt.excluded.dateOfBirth,
-                    "gender": insert_stmt.excluded.gender,
-                },
-            ).returning(target_users.c.id, target_users.c.username)
-
-            result_set = conn.execute(upsert_stmt)
-            conn.commit()
-            db_rows = result_set.fetchall()
-            total_inserted += len(df)
-            
+                update_columns=["firstName", "lastName", "dateOfBirth", "gender"],
+                returning=["id", "username"],
+            )
+            record("rows_out", len(df))
+
             if db_rows:
                 surrogate_key_df = pd.DataFrame(db_rows, columns=['id', 'username'])
                 surrogate_key_df = surrogate_key_df.rename(columns={'id': 'surrogate_key'})
@@ -125,17 +153,37 @@ def extractUser():
                 merged_df = pd.merge(df, surrogate_key_df, on='username', how='inner')
 
                 if not merged_df.empty:
+                    saveKeyMap(conn, "user", merged_df)
                     mapping_data.append(merged_df[['nat_key', 'surrogate_key']])
-            
-            #total_inserted += len(df)
-            del df, chunk, db_rows
-            if 'surrogate_key_df' in locals():
-                del surrogate_key_df
-            if 'merged_df' in locals():
-                del merged_df
-            gc.collect()
 
-    mapped_df = pd.concat(mapping_data, ignore_index=True) if mapping_data else pd.DataFrame(columns=['nat_key', 'surrogate_key'])
+            gc.collect()
+            return len(df)
+
+        def checkpoint(conn, position):
+            setCheckpoint(conn, "user", high_water, position)
+
+        # dimension stages may all be running at once
+        with writerConnections(conn, writerCount(maxWorkers())) as connections:
+            for range_low, range_high in ranges:
+                reader = readPages(session, stmt, users.c.id, range_low, range_high, sizer.current, SOURCE_DTYPES)
+                total_inserted += runPipeline(
+                    reader, transform, load, connections,
+                    metrics=stage_metrics, sizer=sizer, checkpoint=checkpoint,
+                )
+
+        clearCheckpoints(conn, "user")
+        if high_water != watermark:
+            setWatermark(conn, "user", high_water)
+        conn.commit()
+
+        delta_df = pd.concat(mapping_data, ignore_index=True) if mapping_data else pd.DataFrame(columns=['nat_key', 'surrogate_key'])
+        mapped_df = refreshKeyMap(conn, "user", watermark, high_water, delta_df, resumed)
+        stage_metrics.set("batch_size", sizer.summary())
+        # unparseable dates always reach the batch totals; the parser's own
+        # counters only see batches cleaned in this process
+        if not TRANSFORM_PROCESSES:
+            stage_metrics.set("dates", BIRTH_DATES.summary())
+        stage_metrics.finish()
     logging.info(f"ETL completed - {total_inserted} users, {len(mapped_df)} mappings")
     end = time.time()
     length = end - start
@@ -1,28 +1,128 @@
-from config import local
+from config import local, supa
 from ETL import user_ETL, date_ETL, loc_ETL, prod_ETL, fact_ETL
+from ETL.scheduler import Stage, runStages
+from ETL.keymap import currentKeyMap
+from ETL.metrics import writeRunSummary
+from ETL.rollup import ensureRollupTables, rebuildRollups
+from ETL.state import setRunVersion
+from olap.memcube import MEMCUBE, buildCube
 from sqlalchemy import text
+from functools import partial
+import argparse
 import time
 
-try:
-    start = time.time()
-    with local.engine.connect() as conn:
-        conn.execute(text("SELECT 1"))
-    print("Connected to local DB.")
-    
 
-    user_df, user_debug = user_ETL.extractUser()
+def loadFacts(user, loc, date, prod, full_refresh=False, workers=None, resume=True, resolve=None):
+    user_df, _ = user
+    loc_df, _ = loc
+    date_df, _ = date
+    prod_df, _ = prod
+    return fact_ETL.extractFact(
+        user_df, loc_df, date_df, prod_df,
+        full_refresh=full_refresh, workers=workers, resume=resume, resolve=resolve,
+    )
 
-    loc_df, loc_debug = loc_ETL.extractLocation()
-    
-    date_df, date_debug = date_ETL.extractDate()
 
-    prod_df, prod_debug = prod_ETL.extractProduct()
+def loadFactsFromCache(full_refresh=False, workers=None, resume=True, resolve=None):
+    if (resolve or fact_ETL.FACT_RESOLVE) == "warehouse":
+        # the warehouse already holds the key maps
+        maps = [None] * 4
+    else:
+        maps = [currentKeyMap(stage) for stage in ("user", "location", "day", "product")]
+    return fact_ETL.extractFact(*maps, full_refresh=full_refresh, workers=workers, resume=resume, resolve=resolve)
 
-    fact_df = fact_ETL.extractFact(user_df, loc_df, date_df, prod_df)
 
-    end = time.time()
-    length = end - start
+def buildStages(full_refresh=False, fact_only=False, fact_workers=None, resume=True, resolve=None):
+    facts = dict(full_refresh=full_refresh, workers=fact_workers, resume=resume, resolve=resolve)
+    if fact_only:
+        return [Stage("fact", partial(loadFactsFromCache, **facts))]
+    # the fact stage stops at this order id too, through the "day" watermark
+    order_high = date_ETL.orderHighWater()
+    return [
+        Stage("user", partial(user_ETL.extractUser, full_refresh=full_refresh, resume=resume)),
+        Stage("location", partial(loc_ETL.extractLocation, full_refresh=full_refresh, resume=resume)),
+        Stage("date", partial(date_ETL.extractDate, full_refresh=full_refresh, order_high=order_high)),
+        Stage("product", partial(prod_ETL.extractProduct, full_refresh=full_refresh, resume=resume)),
+        Stage("fact", partial(loadFacts, **facts), deps=["user", "location", "date", "product"]),
+    ]
 
-    print("Fact extraction took", length, "seconds")
-except Exception as e:
-    print(f"Connection failed {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the source database into the Supabase warehouse.")
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="ignore stored watermarks and re-extract every source row",
+    )
+    parser.add_argument(
+        "--fact-only",
+        action="store_true",
+        help="skip the dimension stages and resolve facts against the cached key maps",
+    )
+    parser.add_argument(
+        "--fact-workers",
+        type=int,
+        help="split the fact load into this many orders.id ranges loaded in parallel (default: FACT_WORKERS)",
+    )
+    parser.add_argument(
+        "--resolve",
+        choices=["client", "warehouse"],
+        help="resolve fact surrogate keys from in-memory key maps or with joins inside the warehouse (default: FACT_RESOLVE)",
+    )
+    parser.add_argument(
+        "--rebuild-rollups",
+        action="store_true",
+        help="recompute the rollup tables from FactSales after the load, e.g. after dimension attributes changed",
+    )
+    parser.add_argument(
+        "--build-cube",
+        action="store_true",
+        help="rebuild the memory-mapped OLAP cube after the load (default: MEMCUBE)",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="discard checkpoints left by an interrupted run instead of resuming from them",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="write the JSON run summary here (default: METRICS_PATH or etl_metrics.json)",
+    )
+    parser.add_argument(
+        "--prometheus",
+        help="also write the run summary in Prometheus text format to this file",
+    )
+    args = parser.parse_args()
+
+    try:
+        start = time.time()
+        with local.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        print("Connected to local DB.")
+
+        results, timings = runStages(buildStages(args.full_refresh, args.fact_only, args.fact_workers, not args.restart, args.resolve))
+
+        with supa.engine.connect() as conn:
+            if args.rebuild_rollups:
+                ensureRollupTables(conn)
+                rebuildRollups(conn)
+            # tells query caches that everything before this load is stale
+            setRunVersion(conn)
+            conn.commit()
+            if args.build_cube or MEMCUBE:
+                buildCube(conn)
+
+        end = time.time()
+        length = end - start
+
+        for name, seconds in timings.items():
+            print(f"  {name}: {seconds:.2f} seconds")
+        print("Fact extraction took", length, "seconds")
+    except Exception as e:
+        print(f"Connection failed {e}")
+    finally:
+        writeRunSummary(args.metrics, args.prometheus)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+from benchmark.generate import generateSource
+from ETL.metrics import RssWindow
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def toMb(size):
+    return round(size / (1024 * 1024), 1)
+
+
+def gitCommit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def timed(phases, name, rows, fn, *args, **kwargs):
+    window = RssWindow()
+    start = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        peak = window.close()
+    seconds = time.perf_counter() - start
+    phases.append({
+        "phase": name,
+        "seconds": round(seconds, 4),
+        "rows": rows,
+        "rows_per_s": round(rows / seconds, 1) if rows and seconds else None,
+        "peak_rss_mb": toMb(peak),
+    })
+    print(f"{name}: {seconds:.2f}s ({rows} rows)", file=sys.stderr)
+    return result
+
+
+def resetWarehouse(keymap_dir):
+    from config import supa
+    from ETL import schema
+    from ETL.state import state_metadata
+    from ETL.rollup import rollup_metadata
+    from model.warehouse import metadata, createWarehouse
+    import ETL.state
+    import ETL.rollup
+
+    with supa.engine.connect() as conn:
+        state_metadata.drop_all(bind=conn)
+        rollup_metadata.drop_all(bind=conn)
+        metadata.drop_all(bind=conn)
+        createWarehouse(conn)
+
+    shutil.rmtree(keymap_dir, ignore_errors=True)
+    schema._memo.clear()
+    ETL.state._ensured = False
+    ETL.rollup._ensured = False
+
+
+def runScale(orders, args, keymap_dir):
+    from config import local
+    from ETL import user_ETL, loc_ETL, date_ETL, prod_ETL, fact_ETL
+    from ETL.scheduler import runStages
+    import app
+
+    phases = []
+    with local.engine.connect() as conn:
+        counts = timed(phases, "generate", orders, generateSource, conn, orders, seed=args.seed)
+
+    resetWarehouse(keymap_dir)
+    user_df, _ = timed(phases, "user", counts["users"], user_ETL.extractUser, full_refresh=True)
+    loc_df, _ = timed(phases, "location", counts["users"], loc_ETL.extractLocation, full_refresh=True)
+    date_df, _ = timed(phases, "date", counts["orders"], date_ETL.extractDate, full_refresh=True)
+    prod_df, _ = timed(phases, "product", counts["products"], prod_ETL.extractProduct, full_refresh=True)
+    timed(
+        phases, "fact", counts["orderitems"], fact_ETL.extractFact,
+        user_df, loc_df, date_df, prod_df, full_refresh=True, workers=args.fact_workers,
+    )
+    del user_df, loc_df, date_df, prod_df
+
+    resetWarehouse(keymap_dir)
+    total_rows = sum(counts.values())
+    timed(phases, "pipeline", total_rows, runStages, app.buildStages(full_refresh=True, fact_workers=args.fact_workers))
+
+    return {"orders": orders, "source_rows": counts, "phases": phases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ETL stages against synthetic source data.")
+    parser.add_argument("--orders", type=int, nargs="+", default=[10_000], help="order counts to benchmark")
+    parser.add_argument("--source-url", default=os.getenv("BENCH_SOURCE_URL"), help="stand-in MySQL source database")
+    parser.add_argument("--warehouse-url", default=os.getenv("BENCH_WAREHOUSE_URL"), help="stand-in Postgres warehouse")
+    parser.add_argument("--fact-workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    if not args.source_url or not args.warehouse_url:
+        parser.error("--source-url and --warehouse-url (or BENCH_SOURCE_URL / BENCH_WAREHOUSE_URL) are required")
+
+    # never touch the real key-map and schema caches
+    work_dir = tempfile.mkdtemp(prefix="etl-bench-")
+    keymap_dir = os.path.join(work_dir, "keymaps")
+    os.environ["KEYMAP_DIR"] = keymap_dir
+    os.environ["SCHEMA_CACHE_DIR"] = os.path.join(work_dir, "schema")
+
+    from config import local, supa
+    local.DATABASE_CONN_STRING = args.source_url
+    supa.DATABASE_CONN_STRING = args.warehouse_url
+
+    report = {
+        "commit": gitCommit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "runs": [],
+    }
+    try:
+        for orders in args.orders:
+            report["runs"].append(runScale(orders, args, keymap_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, Float,
+)
+import numpy as np
+import pandas as pd
+
+# Stand-in source schema, shaped like the tables the ETL modules read
+source_metadata = MetaData()
+
+source_users = Table(
+    "users",
+    source_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("username", String(255)),
+    Column("firstName", String(255)),
+    Column("lastName", String(255)),
+    Column("dateOfBirth", String(32)),
+    Column("gender", String(16)),
+    Column("address1", String(255)),
+    Column("address2", String(255)),
+    Column("city", String(255)),
+    Column("country", String(255)),
+    Column("zipCode", String(32)),
+)
+
+source_products = Table(
+    "products",
+    source_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("category", String(255)),
+    Column("description", String(255)),
+    Column("name", String(255)),
+    Column("price", Float),
+)
+
+source_orders = Table(
+    "orders",
+    source_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("orderNumber", String(64)),
+    Column("userId", Integer, index=True),
+    Column("deliveryDate", String(32)),
+)
+
+source_orderitems = Table(
+    "orderitems",
+    source_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("OrderId", Integer, index=True),
+    Column("ProductId", Integer),
+    Column("quantity", Integer),
+)
+
+FIRST_NAMES = np.array(["john", "MARY", "  jose ", "Ana", "li", "Wei ", "maria", "DAVID", "sara", "miguel"])
+LAST_NAMES = np.array(["smith", " Santos", "GARCIA", "reyes ", "Tan", "cruz", "LEE", "bautista"])
+GENDERS = np.array(["male", "Female", " m", "F", "FEMALE ", "M", "f", "Male"])
+STREETS = np.array(["rizal st", "Main Street ", " mabini ave", "BONIFACIO DR", "oak lane"])
+UNITS = np.array(["unit 1", "Apt 2B", " suite 300", "FLOOR 4", "room 5"])
+CITIES = np.array(["manila", " Quezon City", "CEBU", "davao ", "Makati", "pasig"])
+COUNTRIES = np.array(["philippines", "Philippines ", "PHILIPPINES"])
+CATEGORIES = np.array([
+    "toy", "Toys ", "appliances", "GADGETS", "electronics", " laptops",
+    "makeup", "Make Up", "bag", "bags", "clothes", "men's apparel",
+])
+DATE_FORMATS = ["%Y-%m-%d", "%m/%d/%Y", "%Y/%m/%d", "%B %d, %Y", "%Y-%m-%d %H:%M:%S"]
+
+
+def _pick(rng, values, n):
+    return values[rng.integers(0, len(values), n)]
+
+
+def _mixedDates(rng, start, days, n):
+    dates = pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days, n), unit="D")
+    formats = rng.integers(0, len(DATE_FORMATS), n)
+    out = np.empty(n, dtype=object)
+    for i, fmt in enumerate(DATE_FORMATS):
+        mask = formats == i
+        out[mask] = dates[mask].strftime(fmt)
+    return out
+
+
+def _noisyCase(rng, values):
+    values = pd.Series(values, dtype=object)
+    mode = rng.integers(0, 4, len(values))
+    values[mode == 1] = values[mode == 1].str.upper()
+    values[mode == 2] = " " + values[mode == 2]
+    values[mode == 3] = values[mode == 3] + "  "
+    return values.to_numpy()
+
+
+def generateUsers(rng, start_id, n):
+    ids = np.arange(start_id, start_id + n)
+    address2 = _pick(rng, UNITS, n).astype(object)
+    address2[rng.random(n) < 0.02] = None
+    return pd.DataFrame({
+        "id": ids,
+        "username": _noisyCase(rng, np.char.add("user", ids.astype(str))),
+        "firstName": _pick(rng, FIRST_NAMES, n),
+        "lastName": _pick(rng, LAST_NAMES, n),
+        "dateOfBirth": _mixedDates(rng, "1960-01-01", 365 * 45, n),
+        "gender": _pick(rng, GENDERS, n),
+        "address1": np.char.add(rng.integers(1, 500, n).astype(str), np.char.add(" ", _pick(rng, STREETS, n))),
+        "address2": address2,
+        "city": _pick(rng, CITIES, n),
+        "country": _pick(rng, COUNTRIES, n),
+        "zipCode": rng.integers(1000, 9999, n).astype(str),
+    })
+
+
+def generateProducts(rng, start_id, n):
+    ids = np.arange(start_id, start_id + n)
+    return pd.DataFrame({
+        "id": ids,
+        "category": _pick(rng, CATEGORIES, n),
+        "description": _noisyCase(rng, np.char.add("description of item ", ids.astype(str))),
+        "name": _noisyCase(rng, np.char.add("item ", ids.astype(str))),
+        "price": np.round(rng.uniform(1, 5000, n), 3),
+    })
+
+
+def generateOrders(rng, start_id, n, n_users):
+    ids = np.arange(start_id, start_id + n)
+    numbers = pd.Series(np.char.add("ord-", np.char.zfill(ids.astype(str), 9)), dtype=object)
+    return pd.DataFrame({
+        "id": ids,
+        "orderNumber": _noisyCase(rng, numbers.to_numpy()),
+        "userId": rng.integers(1, n_users + 1, n),
+        "deliveryDate": _mixedDates(rng, "2021-01-01", 365 * 4, n),
+    })
+
+
+def generateOrderItems(rng, start_id, order_ids, n_products):
+    per_order = rng.integers(1, 4, len(order_ids))
+    n = int(per_order.sum())
+    return pd.DataFrame({
+        "id": np.arange(start_id, start_id + n),
+        "OrderId": np.repeat(order_ids, per_order),
+        "ProductId": rng.integers(1, n_products + 1, n),
+        "quantity": rng.integers(1, 6, n),
+    })
+
+
+def scaleFor(orders):
+    # keep the dimension/fact ratios roughly constant across scales
+    return {
+        "orders": orders,
+        "users": max(100, orders // 10),
+        "products": max(50, orders // 200),
+    }
+
+
+def generateSource(conn, orders, seed=0, chunk_size=100_000):
+    rng = np.random.default_rng(seed)
+    scale = scaleFor(orders)
+    counts = {"users": 0, "products": 0, "orders": 0, "orderitems": 0}
+
+    source_metadata.drop_all(bind=conn)
+    source_metadata.create_all(bind=conn)
+    conn.commit()
+
+    def insertFrame(table, df):
+        records = df.astype(object).where(df.notna(), None).to_dict(orient="records")
+        conn.execute(table.insert(), records)
+        conn.commit()
+        counts[table.name] += len(df)
+
+    for start in range(0, scale["users"], chunk_size):
+        n = min(chunk_size, scale["users"] - start)
+        insertFrame(source_users, generateUsers(rng, start + 1, n))
+
+    for start in range(0, scale["products"], chunk_size):
+        n = min(chunk_size, scale["products"] - start)
+        insertFrame(source_products, generateProducts(rng, start + 1, n))
+
+    item_id = 1
+    for start in range(0, orders, chunk_size):
+        n = min(chunk_size, orders - start)
+        order_df = generateOrders(rng, start + 1, n, scale["users"])
+        insertFrame(source_orders, order_df)
+        items_df = generateOrderItems(rng, item_id, order_df["id"].to_numpy(), scale["products"])
+        insertFrame(source_orderitems, items_df)
+        item_id += len(items_df)
+
+    return counts
@@ -2,6 +2,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
+import threading
 
 load_dotenv()
 
@@ -10,10 +11,33 @@ LOCAL_PASSWORD = os.getenv("LOCAL_PASSWORD")
 LOCAL_HOST = os.getenv("LOCAL_HOST")
 LOCAL_DB = os.getenv("LOCAL_DB")
 
+POOL_SIZE = int(os.getenv("LOCAL_POOL_SIZE") or 10)
+MAX_OVERFLOW = int(os.getenv("LOCAL_MAX_OVERFLOW") or 20)
+
 DATABASE_CONN_STRING = f"mysql+pymysql://{
     LOCAL_USER}:{LOCAL_PASSWORD}@{LOCAL_HOST}/{LOCAL_DB}"
-engine = create_engine(
-    DATABASE_CONN_STRING, pool_pre_ping=True, pool_size=10, max_overflow=20
-)
 
-Session = sessionmaker(bind=engine)
+_engine = None
+_Session = None
+_lock = threading.Lock()
+
+
+def getEngine():
+    # built on first use so importing an ETL module never opens a pool
+    global _engine, _Session
+    with _lock:
+        if _engine is None:
+            _engine = create_engine(
+                DATABASE_CONN_STRING, pool_pre_ping=True, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW
+            )
+            _Session = sessionmaker(bind=_engine)
+    return _engine
+
+
+def __getattr__(name):
+    if name == "engine":
+        return getEngine()
+    if name == "Session":
+        getEngine()
+        return _Session
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
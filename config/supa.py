@@ -2,6 +2,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
+import threading
 
 load_dotenv()
 
@@ -11,16 +12,38 @@ ONLINE_HOST = os.getenv("ONLINE_HOST")
 ONLINE_PORT = os.getenv("ONLINE_PORT")
 ONLINE_DBNAME = os.getenv("ONLINE_DBNAME")
 
+POOL_SIZE = int(os.getenv("ONLINE_POOL_SIZE") or 10)
+MAX_OVERFLOW = int(os.getenv("ONLINE_MAX_OVERFLOW") or 20)
+
 DATABASE_CONN_STRING = (
     f"postgresql+psycopg2://{ONLINE_USER}:{ONLINE_PASSWORD}@"
     f"{ONLINE_HOST}:{ONLINE_PORT}/{ONLINE_DBNAME}?sslmode=require"
 )
 
-engine = create_engine(
-    DATABASE_CONN_STRING,
-    pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20,
-)
+_engine = None
+_Session = None
+_lock = threading.Lock()
+
+
+def getEngine():
+    # built on first use so importing an ETL module never opens a pool
+    global _engine, _Session
+    with _lock:
+        if _engine is None:
+            _engine = create_engine(
+                DATABASE_CONN_STRING,
+                pool_pre_ping=True,
+                pool_size=POOL_SIZE,
+                max_overflow=MAX_OVERFLOW,
+            )
+            _Session = sessionmaker(bind=_engine)
+    return _engine
+
 
-Session = sessionmaker(bind=engine)
+def __getattr__(name):
+    if name == "engine":
+        return getEngine()
+    if name == "Session":
+        getEngine()
+        return _Session
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,15 +1,13 @@
-from sqlalchemy import create_engine, Table, Column, Integer, String, Date, Float, ForeignKey
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-import FactTable
-
-class Base(DeclarativeBase):
-    pass
+from sqlalchemy import Date
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from model.base import Base
+import datetime
 
 class DateDimension(Base):
     __tablename__ = "Date"
-    FactSales = FactTable.FactSales
 
-    id: Mapped[int] = mapped_column(primary_key=True)
-    createdAt: Mapped[Date] = mapped_column(Date)
+    # smart key YYYYMMDD, so FactSales can be range-partitioned on DateId
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    date: Mapped[datetime.date] = mapped_column(Date, unique=True)
 
-    sales: Mapped[list[FactSales]] = relationship(back_populates="date")
\ No newline at end of file
+    sales: Mapped[list["FactSales"]] = relationship(back_populates="date")
@@ -1,19 +1,20 @@
-from sqlalchemy import create_engine, Table, Column, Integer, String, Date, Float, ForeignKey
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-import UserDimension
-import LocationDimension
-import ProductDimension
-import DateDimension
-
-class Base(DeclarativeBase):
-    pass
+from sqlalchemy import Integer, String, Float, ForeignKey, Index, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from model.base import Base
 
 class FactSales(Base):
     __tablename__ = "FactSales"
-    User = UserDimension.User
-    Location = LocationDimension.Location
-    Product = ProductDimension.Product
-    _Date = DateDimension.DateDimension
+    # Range-partitioned by DateId (monthly, see model.warehouse). Postgres wants
+    # the partition key in every unique key, hence (id, DateId) and
+    # (OrderNumber, DateId); the plain OrderNumber index serves lookups by order.
+    __table_args__ = (
+        UniqueConstraint("OrderNumber", "DateId"),
+        Index("ix_FactSales_OrderNumber", "OrderNumber"),
+        Index("ix_FactSales_UserId", "UserId"),
+        Index("ix_FactSales_ProductId", "ProductId"),
+        Index("ix_FactSales_LocationId", "LocationId"),
+        {"postgresql_partition_by": 'RANGE ("DateId")'},
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     quantity: Mapped[int] = mapped_column(Integer)
@@ -23,9 +24,9 @@ class FactSales(Base):
     UserId: Mapped[int] = mapped_column(ForeignKey("Users.id"))
     ProductId: Mapped[int] = mapped_column(ForeignKey("Products.id"))
     LocationId: Mapped[int] = mapped_column(ForeignKey("Location.id"))
-    DateId: Mapped[int] = mapped_column(ForeignKey("Date.id"))
+    DateId: Mapped[int] = mapped_column(ForeignKey("Date.id"), primary_key=True)
     
-    user: Mapped[User] = relationship(back_populates="sales")
-    product: Mapped[Product] = relationship(back_populates="sales")
-    location: Mapped[Location] = relationship(back_populates="sales")
-    date: Mapped[_Date] = relationship(back_populates="sales")
\ No newline at end of file
+    user: Mapped["User"] = relationship(back_populates="sales")
+    product: Mapped["Product"] = relationship(back_populates="sales")
+    location: Mapped["Location"] = relationship(back_populates="sales")
+    date: Mapped["DateDimension"] = relationship(back_populates="sales")
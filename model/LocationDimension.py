@@ -1,13 +1,11 @@
-from sqlalchemy import create_engine, Table, Column, Integer, String, Date, Float, ForeignKey
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-import FactTable
-
-class Base(DeclarativeBase):
-    pass
+from sqlalchemy import String, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from model.base import Base
 
 class Location(Base):
     __tablename__ = "Location"
-    FactSales = FactTable.FactSales
+    # the location stage upserts on this key
+    __table_args__ = (UniqueConstraint("address1", "address2", "city"),)
     
     id: Mapped[int] = mapped_column(primary_key=True)
     address1: Mapped[str] = mapped_column(String(255))
@@ -16,4 +14,4 @@ class Location(Base):
     country: Mapped[str] = mapped_column(String(255))
     zipCode: Mapped[str] = mapped_column(String(255))
 
-    sales: Mapped[list[FactSales]] = relationship(back_populates="location")
\ No newline at end of file
+    sales: Mapped[list["FactSales"]] = relationship(back_populates="location")
@@ -1,13 +1,11 @@
-from sqlalchemy import create_engine, Table, Column, Integer, String, Date, Float, ForeignKey
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-import FactTable
-
-class Base(DeclarativeBase):
-    pass
+from sqlalchemy import String, Float, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from model.base import Base
 
 class Product(Base):
     __tablename__ = "Products"
-    FactSales = FactTable.FactSales
+    # the product stage upserts on this key
+    __table_args__ = (UniqueConstraint("name", "description"),)
 
     id: Mapped[int] = mapped_column(primary_key=True)
     category: Mapped[str] = mapped_column(String(255))
@@ -15,4 +13,4 @@ class Product(Base):
     name: Mapped[str] = mapped_column(String(255))
     price: Mapped[float] = mapped_column(Float)
 
-    sales: Mapped[list[FactSales]] = relationship(back_populates="product")
\ No newline at end of file
+    sales: Mapped[list["FactSales"]] = relationship(back_populates="product")
@@ -1,17 +1,16 @@
-from sqlalchemy import create_engine, Table, Column, Integer, String, Date, Float, ForeignKey
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-
-class Base(DeclarativeBase):
-    pass
+from sqlalchemy import String, Date
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from model.base import Base
+import datetime
 
 class User(Base):
     __tablename__ = "Users"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    username: Mapped[str] = mapped_column(String(255))
+    username: Mapped[str] = mapped_column(String(255), unique=True)
     firstName: Mapped[str] = mapped_column(String(255))
     lastName: Mapped[str] = mapped_column(String(255))
-    dateOfBirth: Mapped[Date] = mapped_column(Date)
+    dateOfBirth: Mapped[datetime.date] = mapped_column(Date)
     gender: Mapped[str] = mapped_column(String(255))
     
-    sales: Mapped[list["FactSales"]] = relationship(back_populates="user")
\ No newline at end of file
+    sales: Mapped[list["FactSales"]] = relationship(back_populates="user")
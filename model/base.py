@@ -0,0 +1,7 @@
+from sqlalchemy.orm import DeclarativeBase
+
+
+# one registry for every dimension and the fact table, so relationships can
+# refer to each other by name instead of importing each other's modules
+class Base(DeclarativeBase):
+    pass
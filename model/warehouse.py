@@ -0,0 +1,177 @@
+from model.base import Base
+from model.UserDimension import User
+from model.LocationDimension import Location
+from model.ProductDimension import Product
+from model.DateDimension import DateDimension
+from model.FactTable import FactSales
+from sqlalchemy import inspect, select, func, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable, CreateIndex
+import argparse
+import datetime
+import logging
+import os
+import sys
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+)
+
+# monthly FactSales partitions kept ready past the newest loaded date
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD") or 3)
+
+metadata = Base.metadata
+fact_table = FactSales.__table__
+
+
+def dateKey(day):
+    return day.year * 10000 + day.month * 100 + day.day
+
+
+def monthStart(day):
+    return datetime.date(day.year, day.month, 1)
+
+
+def nextMonth(month):
+    return datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def partitionName(month):
+    return f"{fact_table.name}_{month:%Y_%m}"
+
+
+def isPartitioned(conn):
+    return bool(conn.execute(text(
+        """
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table pt
+              JOIN pg_class c ON c.oid = pt.partrelid
+             WHERE c.relname = :name AND c.relnamespace = current_schema()::regnamespace)
+        """
+    ), {"name": fact_table.name}).scalar())
+
+
+def existingPartitions(conn):
+    return set(conn.execute(text(
+        """
+        SELECT c.relname FROM pg_inherits i
+          JOIN pg_class c ON c.oid = i.inhrelid
+          JOIN pg_class p ON p.oid = i.inhparent
+         WHERE p.relname = :name AND p.relnamespace = current_schema()::regnamespace
+        """
+    ), {"name": fact_table.name}).scalars())
+
+
+def wantedPartitions(first, last, ahead=PARTITION_MONTHS_AHEAD):
+    end = monthStart(last)
+    for _ in range(ahead):
+        end = nextMonth(end)
+    month = monthStart(first)
+    while month <= end:
+        yield month
+        month = nextMonth(month)
+
+
+def ensurePartitions(conn, first, last, ahead=PARTITION_MONTHS_AHEAD):
+    # monthly partitions for first..last plus `ahead` months; a no-op when
+    # FactSales is a plain table
+    if not isPartitioned(conn):
+        return []
+    quote = conn.dialect.identifier_preparer.quote
+    existing = existingPartitions(conn)
+    created = []
+    for month in wantedPartitions(first, last, ahead):
+        name = partitionName(month)
+        if name in existing:
+            continue
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {quote(name)} PARTITION OF {quote(fact_table.name)} "
+            f"FOR VALUES FROM ({dateKey(month)}) TO ({dateKey(nextMonth(month))})"
+        ))
+        created.append(name)
+    if created:
+        logging.info(f"Created {len(created)} FactSales partitions: {created[0]} .. {created[-1]}.")
+    return created
+
+
+def _dateSpan(conn):
+    date = DateDimension.__table__
+    first, last = conn.execute(select(func.min(date.c.date), func.max(date.c.date))).one()
+    today = datetime.date.today()
+    return min(first or today, today), max(last or today, today)
+
+
+def createWarehouse(conn, ahead=PARTITION_MONTHS_AHEAD):
+    metadata.create_all(bind=conn, checkfirst=True)
+    ensurePartitions(conn, *_dateSpan(conn), ahead)
+    conn.commit()
+
+
+def _keys(inspector, name):
+    keys = {tuple(ix["column_names"]) for ix in inspector.get_indexes(name)}
+    keys |= {tuple(uq["column_names"]) for uq in inspector.get_unique_constraints(name)}
+    keys.add(tuple(inspector.get_pk_constraint(name)["constrained_columns"]))
+    return keys
+
+
+def verifyWarehouse(conn, ahead=PARTITION_MONTHS_AHEAD):
+    problems = []
+    inspector = inspect(conn)
+    existing = set(inspector.get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name not in existing:
+            problems.append(f"missing table {table.name}")
+            continue
+        keys = _keys(inspector, table.name)
+        wanted = [tuple(c.name for c in ix.columns) for ix in table.indexes]
+        wanted += [tuple(c.name for c in uq.columns) for uq in table.constraints if uq.__visit_name__ in ("unique_constraint", "primary_key_constraint")]
+        for columns in wanted:
+            if columns not in keys:
+                problems.append(f"{table.name} has no index on ({', '.join(columns)})")
+    if problems:
+        return problems
+
+    if not isPartitioned(conn):
+        problems.append(f"{fact_table.name} is not range-partitioned by DateId")
+        return problems
+    partitions = existingPartitions(conn)
+    for month in wantedPartitions(*_dateSpan(conn), ahead):
+        if partitionName(month) not in partitions:
+            problems.append(f"missing partition {partitionName(month)}")
+    return problems
+
+
+def ddl():
+    dialect = postgresql.dialect()
+    for table in metadata.sorted_tables:
+        yield str(CreateTable(table).compile(dialect=dialect)).strip() + ";"
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            yield str(CreateIndex(index).compile(dialect=dialect)).strip() + ";"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or verify the warehouse schema from the model package.")
+    parser.add_argument("command", choices=["create", "verify", "ddl"])
+    parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD,
+                        help="FactSales partitions to keep ready past the newest date")
+    args = parser.parse_args()
+
+    if args.command == "ddl":
+        print("\n\n".join(ddl()))
+        return
+
+    from config import supa
+    with supa.engine.connect() as conn:
+        if args.command == "create":
+            createWarehouse(conn, args.months_ahead)
+        problems = verifyWarehouse(conn, args.months_ahead)
+
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+    print("Warehouse layout OK.")
+
+
+if __name__ == "__main__":
+    main()
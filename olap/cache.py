@@ -0,0 +1,52 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+
+OLAP_CACHE_SIZE = int(os.getenv("OLAP_CACHE_SIZE") or 256)
+OLAP_CACHE_TTL = float(os.getenv("OLAP_CACHE_TTL") or 300)
+
+
+class QueryCache:
+    # LRU with a time-to-live; every entry also belongs to one ETL run version
+    # and the whole cache empties as soon as a newer run is seen
+    def __init__(self, maxsize=OLAP_CACHE_SIZE, ttl=OLAP_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def setVersion(self, version):
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "version": self.version}
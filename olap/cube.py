@@ -0,0 +1,238 @@
+from model.warehouse import FactSales, DateDimension, Product, Location, User
+from ETL.rollup import ROLLUPS, rollup_daily, rollup_category, rollup_location, rollup_month_category
+from ETL.state import getRunVersion
+from olap.cache import QueryCache
+from sqlalchemy import Date, Integer, select, func
+import pandas as pd
+import logging
+import os
+import threading
+import time
+
+# how often the run version stamp is re-read; cached results never outlive
+# a new load by more than this
+OLAP_VERSION_CHECK = float(os.getenv("OLAP_VERSION_CHECK") or 30)
+
+facts = FactSales.__table__
+dates = DateDimension.__table__
+products = Product.__table__
+locations = Location.__table__
+users = User.__table__
+
+MEASURES = ("revenue", "quantity", "orderCount")
+
+# coarse to fine; roll-up moves left, drill-down moves right
+HIERARCHIES = (
+    ("year", "month", "date"),
+    ("category", "name"),
+    ("country", "city"),
+    ("gender",),
+)
+ATTRIBUTES = {attr for hierarchy in HIERARCHIES for attr in hierarchy}
+
+
+def _year(col):
+    return func.cast(func.extract("year", col), Integer)
+
+
+def _month(col):
+    return func.cast(func.date_trunc("month", col), Date)
+
+
+class Source:
+    # A table that can answer queries over some attributes. attributes maps
+    # attribute -> (expression, dimension table to join or None).
+    def __init__(self, name, table, attributes, measures, joins=None):
+        self.name = name
+        self.table = table
+        self.attributes = attributes
+        self.measures = measures
+        self.joins = joins or {}
+
+    def covers(self, query):
+        return query.attributes() <= self.attributes.keys() and set(query.measures) <= self.measures.keys()
+
+    def select(self, query):
+        group = [self.attributes[attr][0] for attr in query.group]
+        stmt = select(
+            *[expr.label(attr) for attr, expr in zip(query.group, group)],
+            *[self.measures[m].label(m) for m in query.measures],
+        )
+
+        source = self.table
+        joined = []
+        for attr in sorted(query.attributes()):
+            dimension = self.attributes[attr][1]
+            if dimension is not None and dimension not in joined:
+                source = source.join(dimension, self.joins[dimension])
+                joined.append(dimension)
+        stmt = stmt.select_from(source)
+
+        for attr, values in query.filters:
+            expr = self.attributes[attr][0]
+            stmt = stmt.where(expr == values[0] if len(values) == 1 else expr.in_(values))
+        if group:
+            stmt = stmt.group_by(*group).order_by(*group)
+        return stmt
+
+
+def _rollup(name, table, attributes, joins=None):
+    return Source(name, table, attributes, {m: func.sum(table.c[m]) for m in MEASURES}, joins)
+
+
+FACT_SOURCE = Source(
+    "FactSales",
+    facts,
+    {
+        "year": (_year(dates.c.date), dates),
+        "month": (_month(dates.c.date), dates),
+        "date": (dates.c.date, dates),
+        "category": (products.c.category, products),
+        "name": (products.c.name, products),
+        "country": (locations.c.country, locations),
+        "city": (locations.c.city, locations),
+        "gender": (users.c.gender, users),
+    },
+    {
+        "revenue": func.sum(facts.c.revenue),
+        "quantity": func.sum(facts.c.quantity),
+        "orderCount": func.count(),
+    },
+    {
+        dates: facts.c.DateId == dates.c.id,
+        products: facts.c.ProductId == products.c.id,
+        locations: facts.c.LocationId == locations.c.id,
+        users: facts.c.UserId == users.c.id,
+    },
+)
+
+# smallest first, so a query lands on the narrowest table that can answer it
+ROLLUP_SOURCES = (
+    _rollup("RollupCategory", rollup_category, {"category": (rollup_category.c.category, None)}),
+    _rollup("RollupLocation", rollup_location, {
+        "country": (rollup_location.c.country, None),
+        "city": (rollup_location.c.city, None),
+    }),
+    _rollup("RollupMonthCategory", rollup_month_category, {
+        "year": (_year(rollup_month_category.c.month), None),
+        "month": (rollup_month_category.c.month, None),
+        "category": (rollup_month_category.c.category, None),
+    }),
+    _rollup(
+        "RollupDaily",
+        rollup_daily,
+        {
+            "year": (_year(dates.c.date), dates),
+            "month": (_month(dates.c.date), dates),
+            "date": (dates.c.date, dates),
+        },
+        {dates: rollup_daily.c.DateId == dates.c.id},
+    ),
+)
+
+
+class Query:
+    def __init__(self, measures=("revenue",), group=(), filters=()):
+        for attr in list(group) + [attr for attr, _ in filters]:
+            if attr not in ATTRIBUTES:
+                raise ValueError(f"Unknown attribute {attr!r}; expected one of {sorted(ATTRIBUTES)}")
+        for measure in measures:
+            if measure not in MEASURES:
+                raise ValueError(f"Unknown measure {measure!r}; expected one of {list(MEASURES)}")
+        self.measures = tuple(measures)
+        self.group = tuple(group)
+        self.filters = tuple(sorted(filters))
+
+    def by(self, *attrs):
+        return Query(self.measures, self.group + tuple(a for a in attrs if a not in self.group), self.filters)
+
+    def dice(self, **values):
+        filters = dict(self.filters)
+        for attr, value in values.items():
+            filters[attr] = tuple(value) if isinstance(value, (list, tuple, set)) else (value,)
+        return Query(self.measures, self.group, filters.items())
+
+    def slice(self, attr, value):
+        return self.dice(**{attr: value})
+
+    def _step(self, attr, offset):
+        if attr not in self.group:
+            raise ValueError(f"{attr!r} is not grouped on")
+        hierarchy = next(h for h in HIERARCHIES if attr in h)
+        level = hierarchy.index(attr) + offset
+        if level >= len(hierarchy):
+            raise ValueError(f"{attr!r} is already the finest level")
+        group = list(self.group)
+        if level < 0:
+            group.remove(attr)
+        else:
+            group[group.index(attr)] = hierarchy[level]
+        return Query(self.measures, group, self.filters)
+
+    def rollUp(self, attr):
+        return self._step(attr, -1)
+
+    def drillDown(self, attr):
+        return self._step(attr, 1)
+
+    def attributes(self):
+        return set(self.group) | {attr for attr, _ in self.filters}
+
+    def key(self):
+        return (self.measures, self.group, self.filters)
+
+    def __repr__(self):
+        return f"Query(measures={self.measures}, group={self.group}, filters={self.filters})"
+
+
+class Cube:
+    def __init__(self, engine=None, cache=None, version_check=OLAP_VERSION_CHECK, memcube=None):
+        self._engine = engine
+        self.memcube = memcube
+        self.cache = cache or QueryCache()
+        self.version_check = version_check
+        self._checked = None
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            from config import supa
+            self._engine = supa.engine
+        return self._engine
+
+    def query(self, *measures):
+        return Query(measures or ("revenue",))
+
+    def route(self, query):
+        if not ROLLUPS:
+            return FACT_SOURCE
+        return next((s for s in ROLLUP_SOURCES if s.covers(query)), FACT_SOURCE)
+
+    def _checkVersion(self):
+        # one cheap lookup every version_check seconds, not one per query
+        with self._lock:
+            now = time.monotonic()
+            if self._checked is not None and now - self._checked < self.version_check:
+                return
+            self._checked = now
+        with self.engine.connect() as conn:
+            self.cache.setVersion(getRunVersion(conn))
+
+    def run(self, query) -> pd.DataFrame:
+        if self.memcube is not None and self.memcube.covers(query):
+            # answered from the memory-mapped cells, no round trip
+            self.memcube.reload()
+            return self.memcube.run(query)
+        self._checkVersion()
+        key = query.key()
+        df = self.cache.get(key)
+        if df is None:
+            source = self.route(query)
+            logging.info(f"Running {query} against {source.name}.")
+            with self.engine.connect() as conn:
+                result = conn.execute(source.select(query))
+                df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+            self.cache.put(key, df)
+        # callers get their own frame to mutate
+        return df.copy()
@@ -0,0 +1,157 @@
+from olap.cube import FACT_SOURCE, MEASURES, Query
+import numpy as np
+import pandas as pd
+import datetime
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+# opt-in: rebuild the memory-mapped cube at the end of every load
+MEMCUBE = (os.getenv("MEMCUBE") or "0") == "1"
+CUBE_DIR = os.getenv("CUBE_DIR") or ".cube"
+CUBE_KEEP = int(os.getenv("CUBE_KEEP") or 2)
+
+# month is stored, year is derived from it at build time
+CUBE_ATTRIBUTES = ("year", "month", "category", "country", "city", "gender")
+_BUILD_GROUP = ("month", "category", "country", "city", "gender")
+
+
+def _codeDtype(size):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if size <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.int64
+
+
+def _encode(value):
+    if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        # NULL attributes come back as None, as from the database
+        return None
+    return value.isoformat() if isinstance(value, datetime.date) else value
+
+
+def _decode(attr, value):
+    return datetime.date.fromisoformat(value) if attr == "month" and value is not None else value
+
+
+def buildCube(conn, path=CUBE_DIR):
+    # One row per (month, category, country, city, gender) cell rather than per
+    # fact: every supported query is a sum over cells, and the cell count stays
+    # in the thousands however large FactSales grows.
+    started = time.perf_counter()
+    query = Query(MEASURES, _BUILD_GROUP)
+    result = conn.execute(FACT_SOURCE.select(query))
+    df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+    df["year"] = [m.year if m is not None else None for m in df["month"]]
+
+    version = time.strftime("%Y%m%d%H%M%S") + f"-{os.getpid()}"
+    version_dir = os.path.join(path, version)
+    os.makedirs(version_dir, exist_ok=True)
+
+    dictionaries = {}
+    for attr in CUBE_ATTRIBUTES:
+        # sorted dictionaries keep code order equal to value order
+        codes, uniques = pd.factorize(df[attr], sort=True, use_na_sentinel=False)
+        np.save(os.path.join(version_dir, f"{attr}.npy"), codes.astype(_codeDtype(len(uniques))))
+        dictionaries[attr] = [_encode(v.item() if hasattr(v, "item") else v) for v in uniques]
+    np.save(os.path.join(version_dir, "revenue.npy"), df["revenue"].to_numpy(dtype=np.float64))
+    np.save(os.path.join(version_dir, "quantity.npy"), df["quantity"].to_numpy(dtype=np.int64))
+    np.save(os.path.join(version_dir, "orderCount.npy"), df["orderCount"].to_numpy(dtype=np.int64))
+    with open(os.path.join(version_dir, "dictionaries.json"), "w") as f:
+        json.dump(dictionaries, f)
+
+    # readers only ever follow CURRENT, so swapping it last keeps every version consistent
+    tmp_path = os.path.join(path, "CURRENT.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"version": version, "cells": len(df)}, f)
+    os.replace(tmp_path, os.path.join(path, "CURRENT"))
+
+    versions = sorted(
+        (d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d))),
+        key=lambda d: os.path.getmtime(os.path.join(path, d)),
+    )
+    for old in versions[:-CUBE_KEEP]:
+        shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+
+    logging.info(f"Built cube {version} with {len(df)} cells in {time.perf_counter() - started:.2f}s.")
+    return version
+
+
+class _Snapshot:
+    # one cube version; replaced whole so a query never mixes two versions
+    def __init__(self, path, version):
+        version_dir = os.path.join(path, version)
+        with open(os.path.join(version_dir, "dictionaries.json")) as f:
+            dictionaries = json.load(f)
+        self.version = version
+        self.dictionaries = {
+            attr: [_decode(attr, v) for v in values] for attr, values in dictionaries.items()
+        }
+        self.index = {attr: {v: i for i, v in enumerate(values)} for attr, values in self.dictionaries.items()}
+        self.codes = {
+            attr: np.load(os.path.join(version_dir, f"{attr}.npy"), mmap_mode="r") for attr in CUBE_ATTRIBUTES
+        }
+        self.measures = {
+            m: np.load(os.path.join(version_dir, f"{m}.npy"), mmap_mode="r") for m in MEASURES
+        }
+
+
+class MemCube:
+    def __init__(self, path=CUBE_DIR):
+        self.path = path
+        self._snapshot = None
+        self._current_mtime = None
+        self._lock = threading.Lock()
+        self.reload()
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def reload(self):
+        # cheap when nothing changed: one stat of CURRENT
+        current = os.path.join(self.path, "CURRENT")
+        mtime = os.stat(current).st_mtime_ns
+        if mtime == self._current_mtime:
+            return False
+        with self._lock:
+            if mtime == self._current_mtime:
+                return False
+            with open(current) as f:
+                version = json.load(f)["version"]
+            self._snapshot = _Snapshot(self.path, version)
+            self._current_mtime = mtime
+        return True
+
+    def covers(self, query):
+        return query.attributes() <= set(CUBE_ATTRIBUTES)
+
+    def run(self, query) -> pd.DataFrame:
+        cube = self._snapshot
+        mask = None
+        for attr, values in query.filters:
+            lookup = cube.index[attr]
+            wanted = [lookup[v] for v in values if v in lookup]
+            codes = cube.codes[attr]
+            hit = codes == wanted[0] if len(wanted) == 1 else np.isin(codes, wanted)
+            mask = hit if mask is None else mask & hit
+
+        measures = {m: cube.measures[m] if mask is None else cube.measures[m][mask] for m in query.measures}
+        if not query.group:
+            return pd.DataFrame({m: [values.sum()] for m, values in measures.items()})
+
+        # distinct code tuples, sorted like the values since the dictionaries
+        # are; sized by the cells present, not by the product of cardinalities
+        codes = np.column_stack([cube.codes[attr] if mask is None else cube.codes[attr][mask] for attr in query.group])
+        groups, cells = np.unique(codes, axis=0, return_inverse=True)
+        cells = cells.reshape(-1)
+
+        columns = [[cube.dictionaries[attr][c] for c in groups[:, i]] for i, attr in enumerate(query.group)]
+        for m, values in measures.items():
+            sums = np.bincount(cells, weights=values, minlength=len(groups))
+            columns.append((sums if m == "revenue" else sums.round().astype(np.int64)).tolist())
+        # built from rows like the SQL path, so both infer the same dtypes
+        return pd.DataFrame(list(zip(*columns)), columns=list(query.group) + list(measures))